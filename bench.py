@@ -0,0 +1,206 @@
+import argparse
+import difflib
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from os import makedirs, path, wait4, waitstatus_to_exitcode
+
+"""
+(C) 2019 Pierre-Jean Grenier
+Licensed under the AGPL 3 (or newer) terms.
+Benchmark NimP code generation over recorded JSON documentation, without Nim.
+"""
+
+ROOT_PATH = path.dirname(path.abspath(__file__))
+NIMP_PATH = path.join(ROOT_PATH, "nimp.py")
+FIXTURES_PATH = path.join(ROOT_PATH, "bench", "fixtures")
+GOLDEN_PATH = path.join(ROOT_PATH, "bench", "golden.nim")
+SCOPED_GOLDEN_PATH = path.join(ROOT_PATH, "bench", "golden_scoped.nim")
+
+# a representative set of libs, generated in this order
+BENCH_LIBS = ["pure/algorithm", "pure/strutils", "pure/httpclient", "pure/collections/tables", "pure/asyncdispatch"]
+
+# stages of the code generation, see stage() in nimp.py
+GENERATION_STAGES = ("load", "parse", "parse_types", "parse_procs", "resolve", "emit")
+# stages reading the documentation, streamed (parse) or loaded at once
+LOADING_STAGES = ("load", "parse", "parse_types", "parse_procs")
+
+parser = argparse.ArgumentParser("Benchmark the code generation of NimP over recorded JSON documentation")
+subparsers = parser.add_subparsers(dest='command', required=True)
+record_parser = subparsers.add_parser('record', help="Record the JSON documentation of the libs with Nim")
+record_parser.add_argument('nimpath', type=str, help="The path to Nim repertory")
+run_parser = subparsers.add_parser('run', help="Generate code from the recorded documentation, and compare it with the golden code")
+run_parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3, help="Number of runs, the fastest one is reported")
+run_parser.add_argument('--update-golden', dest='update_golden', action="store_true", help="Write the generated code as the golden code")
+repair_parser = subparsers.add_parser('repair', help="Generate code from the recorded documentation, and repair it with the fake compiler")
+repair_parser.add_argument('--fake-errors', dest='fake_errors', type=str, default=r"\bsplit\b|\bnewAsyncHttpClient\b", help="Lines of code failing, as a regular expression")
+repair_parser.add_argument('--fake-silent', dest='fake_silent', type=str, default=r"\bsort\b", help="Lines of code failing without location, as a regular expression")
+repair_parser.add_argument('--fake-latency', dest='fake_latency', type=str, default="0.1", help="Duration of each compilation, in seconds")
+repair_parser.add_argument('-j', '--jobs', dest='jobs', type=str, default="1", help="Number of parallel jobs")
+repair_parser.add_argument('--chunk-size', dest='chunk_size', type=str, default="100", help="Number of procs per module")
+load_parser = subparsers.add_parser('load', help="Compare reading the recorded documentation entry by entry, and loading it at once")
+load_parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3, help="Number of runs, the fastest one is reported")
+check_parser = subparsers.add_parser('check', help="Check that reading the recorded documentation entry by entry gives the same code as loading it at once, whatever the read size")
+check_parser.add_argument('--read-sizes', dest='read_sizes', type=str, default="1,2,3,5,8,13,64,65536", help="Numbers of characters read at once, comma separated")
+for p in (run_parser, repair_parser):
+    p.add_argument('-s', '--scoped', dest='scoped', action="store_true", help="Generate code in scoped mode (see nimp.py)")
+for p in (record_parser, run_parser, repair_parser, load_parser, check_parser):
+    p.add_argument('libs', type=str, nargs='*', default=BENCH_LIBS, help="The Nim libraries to use")
+args = parser.parse_args()
+
+# return the path of the recorded documentation of a lib
+def fixture_path(nimlib):
+    return path.join(FIXTURES_PATH, nimlib.replace("/", "_") + ".json")
+
+
+# record the documentation of the libs, along with the Nim version
+def record():
+    makedirs(FIXTURES_PATH, exist_ok=True)
+    nimbin = path.join(args.nimpath, "bin/nim")
+    for nimlib in args.libs:
+        print(f"# Recording {nimlib}")
+        subprocess.run([nimbin, "jsondoc", f"-o:{fixture_path(nimlib)}", path.join(args.nimpath, "lib", nimlib)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    with open(path.join(FIXTURES_PATH, "VERSION"), "w") as f:
+        f.write(subprocess.run([nimbin, "--version"], stdout=subprocess.PIPE, text=True).stdout.split("\n")[0] + "\n")
+
+# generate the code of the libs once, in batch mode, and don't compile it
+# unless other options are given
+# return the wall time, the peak memory in KB, and the metrics of the run
+def run_once(libs, workspace, options=("-n",), docs_path=FIXTURES_PATH):
+    output = path.join(workspace, "bench_code.nim")
+    metrics = path.join(workspace, "metrics.json")
+    cmd = [sys.executable, NIMP_PATH, "-nc", "-b", "-g", "-d", docs_path, "-o", output,
+           "--metrics", metrics, *options, ROOT_PATH] + libs
+    start = time.perf_counter()
+    p = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    # NB: the peak memory of this very process, not of all children
+    _, status, rusage = wait4(p.pid, 0)
+    wall = time.perf_counter() - start
+    if waitstatus_to_exitcode(status) != 0:
+        print(f"ERROR: {' '.join(cmd)} failed")
+        exit(1)
+    with open(metrics, "r") as f:
+        return wall, rusage.ru_maxrss, json.load(f)
+
+# return the libs whose documentation was recorded
+def recorded_libs():
+    libs = [nimlib for nimlib in args.libs if path.exists(fixture_path(nimlib))]
+    for nimlib in args.libs:
+        if nimlib not in libs:
+            print(f"WARNING: no recorded documentation for {nimlib}, see: bench.py record /path/to/Nim/")
+    if not libs:
+        exit(1)
+    return libs
+
+def run():
+    libs = recorded_libs()
+    golden_path = SCOPED_GOLDEN_PATH if args.scoped else GOLDEN_PATH
+    with tempfile.TemporaryDirectory() as workspace:
+        runs = [run_once(libs, workspace, ["-n"] + ["-s"] * args.scoped) for _ in range(args.repeat)]
+        with open(path.join(workspace, "bench_code.nim"), "r") as f:
+            code = f.read()
+
+    wall, _, metrics = min(runs, key=lambda k: k[0])
+    peak = max(k[1] for k in runs)
+    procs = metrics["counters"]["procs"]
+    generation = sum(metrics["stages"].get(k, {"wall": 0})["wall"] for k in GENERATION_STAGES)
+    print(f"# {len(libs)} libs, {procs} procs ({metrics['counters']['skipped']} skipped), best of {args.repeat} runs")
+    for name in GENERATION_STAGES:
+        entry = metrics["stages"].get(name)
+        if entry:
+            print(f"# {name}: {entry['count']} times, {entry['wall']:.3f}s wall, {entry['cpu']:.3f}s cpu")
+    print(f"# {procs / generation if generation else 0:.0f} procs/s, {wall:.2f}s in total, {peak / 1024:.1f} MB peak memory")
+    print(f"# {len(code)} bytes of code, {code.count(chr(10))} lines")
+
+    if args.update_golden:
+        with open(golden_path, "w") as f:
+            f.write(code)
+        print(f"# Golden code written to {golden_path}")
+        return
+    if not path.exists(golden_path):
+        print(f"ERROR: no golden code to compare with, {golden_path} does not exist (see --update-golden)")
+        exit(1)
+    with open(golden_path, "r") as f:
+        golden = f.read()
+    if code != golden:
+        diff = list(difflib.unified_diff(golden.split("\n"), code.split("\n"), "golden", "generated", lineterm=""))
+        print("\n".join(diff[:50]))
+        print(f"ERROR: the generated code differs from the golden code ({len(diff)} lines of diff)")
+        exit(1)
+    print("# The generated code matches the golden code")
+
+# the number of compilations and the time spent compiling, with a given
+# repair strategy (see the options of nimp.py)
+def repair():
+    libs = recorded_libs()
+    options = ["--backend", "fake", "--fake-errors", args.fake_errors, "--fake-silent", args.fake_silent,
+               "--fake-latency", args.fake_latency, "-j", args.jobs, "--chunk-size", args.chunk_size] + ["-s"] * args.scoped
+    with tempfile.TemporaryDirectory() as workspace:
+        wall, _, metrics = run_once(libs, workspace, options)
+    counters = metrics["counters"]
+    compilations = counters["compilations"]
+    print(f"# {counters['compiled']}/{counters['procs']} procs compiled")
+    for name in ("compile_check", "compile_c", "repair"):
+        entry = metrics["stages"].get(name)
+        if entry:
+            print(f"# {name}: {entry['count']} times, {entry['wall']:.2f}s wall")
+    print(f"# {sum(compilations.values())} compilations ({compilations.get('check', 0)} check, {compilations.get('c', 0)} c), {wall:.2f}s in total")
+
+# the time spent reading the documentation, and the peak memory, when
+# streaming it and when loading it at once (see --whole-docs in nimp.py)
+def load():
+    libs = recorded_libs()
+    size = sum(path.getsize(fixture_path(nimlib)) for nimlib in libs)
+    print(f"# {len(libs)} libs, {size / 1024 / 1024:.1f} MB of documentation, best of {args.repeat} runs")
+    for name, options in (("streamed", ["-n"]), ("whole", ["-n", "--whole-docs"])):
+        with tempfile.TemporaryDirectory() as workspace:
+            runs = [run_once(libs, workspace, options) for _ in range(args.repeat)]
+        # NB: the documentation is read while the code of the previous libs
+        # is generated, the CPU time is not affected
+        wall, cpu = (min(sum(metrics["stages"].get(k, {m: 0})[m] for k in LOADING_STAGES) for _, _, metrics in runs) for m in ("wall", "cpu"))
+        peak = max(k[1] for k in runs)
+        print(f"# {name}: {wall:.3f}s wall, {cpu:.3f}s cpu reading the documentation, {peak / 1024:.1f} MB peak memory")
+
+# compare the code generated when reading the documentation entry by entry,
+# with several read sizes, and when loading it at once with json.load
+# numbers are the hardest to read entry by entry, as a number cut by a read
+# (eg. "1." or "1e") is a number as well: more of them are added to the
+# recorded documentation
+def check():
+    libs = recorded_libs()
+    read_sizes = [int(k) for k in args.read_sizes.split(",")]
+    with tempfile.TemporaryDirectory() as workspace:
+        docs_path = path.join(workspace, "docs")
+        makedirs(docs_path)
+        for nimlib in libs:
+            with open(fixture_path(nimlib), "r") as f:
+                doc = json.load(f)
+            doc = {"version": 1.5e3, "count": -12, **doc, "size": 2.5e-7}
+            doc["entries"] = [{**entry, "line": k * 1.25e-3, "col": k} for k, entry in enumerate(doc["entries"])]
+            with open(path.join(docs_path, path.basename(fixture_path(nimlib))), "w") as f:
+                json.dump(doc, f)
+
+        codes = dict()
+        for name, options in [("whole", ["--whole-docs"])] + [(f"read size {k}", ["--read-size", str(k)]) for k in read_sizes]:
+            run_once(libs, workspace, ["-n"] + options, docs_path)
+            with open(path.join(workspace, "bench_code.nim"), "r") as f:
+                codes[name] = f.read()
+    differing = [name for name, code in codes.items() if code != codes["whole"]]
+    if differing:
+        print(f"ERROR: the code differs from the code of the documentation loaded at once, with {', '.join(differing)}")
+        exit(1)
+    print(f"# The code is the same with {len(read_sizes)} read sizes ({args.read_sizes}) as with the documentation loaded at once")
+
+if args.command == "record":
+    record()
+elif args.command == "repair":
+    repair()
+elif args.command == "load":
+    load()
+elif args.command == "check":
+    check()
+else:
+    run()
@@ -0,0 +1,312 @@
+
+import os, tables, strutils, times, heapqueue, lists, options, asyncstreams, nativesockets, net, deques
+import algorithm
+import httpclient
+import asyncdispatch
+type MyEnum = enum first = "1st", second, third = "3rd"
+
+discard algorithm.`*`(1, SortOrder.Descending)
+
+var v_algorithm_1_0 = [1]
+algorithm.fill(v_algorithm_1_0, 1, 1, 1)
+
+var v_algorithm_2_0 = [1]
+algorithm.fill(v_algorithm_2_0, 1)
+
+var v_algorithm_3_0 = [1]
+algorithm.reverse(v_algorithm_3_0, 1, 1)
+
+var v_algorithm_4_0 = [1]
+algorithm.reverse(v_algorithm_4_0)
+
+discard algorithm.reversed([1], 1, 1)
+
+discard algorithm.reversed([1])
+
+discard algorithm.binarySearch([1], 1, nil)
+
+discard algorithm.binarySearch([1], 1)
+
+discard algorithm.lowerBound([1], 1, nil)
+
+discard algorithm.upperBound([1], 1)
+
+var v_algorithm_11_0 = [1]
+algorithm.sort(v_algorithm_11_0, nil)
+
+var v_algorithm_12_0 = [1]
+algorithm.sort(v_algorithm_12_0)
+
+discard algorithm.sorted([1])
+
+discard algorithm.isSorted([1])
+
+discard algorithm.product([@[1]])
+
+var v_algorithm_16_0 = [1]
+discard algorithm.nextPermutation(v_algorithm_16_0)
+
+var v_algorithm_17_0 = [1]
+discard algorithm.prevPermutation(v_algorithm_17_0)
+
+var v_algorithm_18_0 = [1]
+discard algorithm.rotateLeft(v_algorithm_18_0, 1 .. 1, 1)
+
+var v_algorithm_19_0 = [1]
+discard algorithm.rotateLeft(v_algorithm_19_0, 1)
+
+discard algorithm.rotatedLeft([1], 1)
+
+discard strutils.isAlphaAscii('a')
+
+discard strutils.isDigit('a')
+
+discard strutils.toLowerAscii("a")
+
+discard strutils.toUpperAscii('a')
+
+discard strutils.capitalizeAscii("a")
+
+discard strutils.normalize("a")
+
+discard strutils.cmpIgnoreCase("a", "a")
+
+discard strutils.split("a")
+
+discard strutils.split("a", "a")
+
+discard strutils.splitLines("a")
+
+discard strutils.toBin(1, 1)
+
+discard strutils.toHex(1, 1)
+
+discard strutils.toHex("a")
+
+discard strutils.intToStr(1)
+
+discard strutils.parseInt("a")
+
+discard strutils.parseBiggestUInt("a")
+
+discard strutils.parseFloat("a")
+
+discard strutils.parseBool("a")
+
+discard strutils.repeat('a', 1)
+
+discard strutils.align("a", 1)
+
+discard strutils.indent("a", 1)
+
+discard strutils.startsWith("a", "a")
+
+var v_strutils_22_0 : string = "a"
+strutils.removeSuffix(v_strutils_22_0, "a")
+
+discard strutils.find("a", 'a')
+
+discard strutils.contains("a", {'a'})
+
+discard strutils.replace("a", "a")
+
+discard strutils.replaceWord("a", "a")
+
+discard strutils.join(["a"])
+
+discard strutils.join([true])
+
+discard strutils.formatFloat(1.0)
+
+var v_strutils_33_0 : int64 = 1
+discard strutils.formatSize(v_strutils_33_0)
+
+discard strutils.`%`("a", ["a"])
+
+discard strutils.strip("a")
+
+discard strutils.escape("a")
+
+discard strutils.unescape("a")
+
+discard strutils.isEmptyOrWhitespace("a")
+
+discard httpclient.code(new(Response))
+
+discard httpclient.contentType(new(Response))
+
+discard httpclient.contentLength(new(Response))
+
+discard httpclient.lastModified(new(Response))
+
+discard httpclient.body(new(Response))
+
+discard httpclient.newProxy("a")
+
+discard httpclient.newMultipartData()
+
+discard httpclient.`$`(new(MultipartData))
+
+var v_httpclient_8_0 = new(MultipartData)
+httpclient.add(v_httpclient_8_0, "a", "a")
+
+var v_httpclient_9_0 = new(MultipartData)
+discard httpclient.add(v_httpclient_9_0, [("a", "a")])
+
+discard httpclient.newMultipartData([("a", "a")])
+
+var v_httpclient_11_0 = new(MultipartData)
+discard httpclient.addFiles(v_httpclient_11_0, [("a", "a")])
+
+var v_httpclient_12_0 = new(MultipartData)
+httpclient.`[]=`(v_httpclient_12_0, "a", "a")
+
+discard httpclient.newHttpClient()
+
+discard httpclient.newAsyncHttpClient()
+
+httpclient.close(new(HttpClient))
+
+discard httpclient.getSocket(new(HttpClient))
+
+discard httpclient.getSocket(new(AsyncHttpClient))
+
+discard httpclient.request(new(HttpClient), "a", "a")
+
+discard httpclient.head(new(HttpClient), "a")
+
+discard httpclient.getContent(new(HttpClient), "a")
+
+discard httpclient.postContent(new(HttpClient), "a")
+
+httpclient.downloadFile(new(HttpClient), "a", "a")
+
+discard tables.initTable()
+
+discard tables.`[]`(Table[1, 1](), 1)
+
+var v_tables_3_0 = Table[1, 1]()
+tables.`[]=`(v_tables_3_0, 1, 1)
+
+discard tables.hasKey(Table[1, 1](), 1)
+
+discard tables.contains(Table[1, 1](), 1)
+
+var v_tables_6_0 = Table[1, 1]()
+discard tables.hasKeyOrPut(v_tables_6_0, 1, 1)
+
+discard tables.getOrDefault(Table[1, 1](), 1, 1)
+
+var v_tables_8_0 = Table[1, 1]()
+discard tables.mgetOrPut(v_tables_8_0, 1, 1)
+
+discard tables.len(Table[1, 1]())
+
+var v_tables_10_0 = Table[1, 1]()
+tables.add(v_tables_10_0, 1, 1)
+
+var v_tables_11_0 = Table[1, 1]()
+tables.del(v_tables_11_0, 1)
+
+var v_tables_12_0 = Table[1, 1]()
+var v_tables_12_1 = 1
+discard tables.take(v_tables_12_0, 1, v_tables_12_1)
+
+var v_tables_13_0 = Table[1, 1]()
+tables.clear(v_tables_13_0)
+
+discard tables.`$`(Table[1, 1]())
+
+discard tables.`==`(Table[1, 1](), Table[1, 1]())
+
+discard tables.indexBy(1, nil)
+
+discard tables.newTable()
+
+discard tables.newTableFrom(1, nil)
+
+discard tables.initOrderedTable()
+
+var v_tables_20_0 = OrderedTable[1, 1]()
+tables.sort(v_tables_20_0, nil)
+
+discard tables.initCountTable()
+
+var v_tables_22_0 = CountTable[1]()
+tables.inc(v_tables_22_0, 1)
+
+discard tables.smallest(CountTable[1]())
+
+discard tables.largest(CountTable[1]())
+
+var v_tables_25_0 = CountTable[1]()
+tables.merge(v_tables_25_0, CountTable[1]())
+
+discard tables.newCountTable([1])
+
+var v_asyncdispatch_0_0 : int = 1
+discard asyncdispatch.`==`(AsyncFD(v_asyncdispatch_0_0), AsyncFD(v_asyncdispatch_0_0))
+
+discard asyncdispatch.newDispatcher()
+
+asyncdispatch.setGlobalDispatcher(new(PDispatcher))
+
+discard asyncdispatch.getGlobalDispatcher()
+
+discard asyncdispatch.getIoHandler(new(PDispatcher))
+
+var v_asyncdispatch_5_0 : int = 1
+asyncdispatch.register(AsyncFD(v_asyncdispatch_5_0))
+
+asyncdispatch.unregister(SelectEvent())
+
+var v_asyncdispatch_7_0 : int = 1
+discard asyncdispatch.contains(new(PDispatcher), AsyncFD(v_asyncdispatch_7_0))
+
+discard asyncdispatch.hasPendingOperations()
+
+asyncdispatch.poll()
+
+asyncdispatch.runForever()
+
+asyncdispatch.drain()
+
+discard asyncdispatch.newAsyncEvent()
+
+asyncdispatch.trigger(SelectEvent())
+
+asyncdispatch.addEvent(SelectEvent(), nil)
+
+asyncdispatch.addTimer(1, true, nil)
+
+discard asyncdispatch.createAsyncNativeSocket()
+
+var v_asyncdispatch_17_0 : int = 1
+asyncdispatch.closeSocket(AsyncFD(v_asyncdispatch_17_0))
+
+discard asyncdispatch.sleepAsync(1)
+
+discard asyncdispatch.withTimeout(Future[1](), 1)
+
+var v_asyncdispatch_20_0 : int = 1
+discard asyncdispatch.accept(AsyncFD(v_asyncdispatch_20_0))
+
+var v_asyncdispatch_21_0 : int = 1
+discard asyncdispatch.send(AsyncFD(v_asyncdispatch_21_0), "a")
+
+var v_asyncdispatch_22_0 : int = 1
+discard asyncdispatch.recvFromInto(AsyncFD(v_asyncdispatch_22_0), nil, 1, cast[ptr SockAddr](0), cast[ptr SockLen](0))
+
+var v_asyncdispatch_23_0 : int = 1
+discard asyncdispatch.sendTo(AsyncFD(v_asyncdispatch_23_0), nil, 1, cast[ptr SockAddr](0), 1)
+
+discard asyncdispatch.readAll(FutureStream["a"]())
+
+asyncdispatch.callSoon(nil)
+
+discard asyncdispatch.waitFor(Future[1]())
+
+discard asyncdispatch.activeDescriptors()
+
+discard asyncdispatch.maxDescriptors()
+
@@ -0,0 +1,447 @@
+
+import os, tables, strutils, times, heapqueue, lists, options, asyncstreams, nativesockets, net, deques
+import algorithm
+import httpclient
+import asyncdispatch
+type MyEnum = enum first = "1st", second, third = "3rd"
+let l_int64_1 : int64 = 1
+
+block:
+  discard algorithm.`*`(1, SortOrder.Descending)
+
+block:
+  var v0 = [1]
+  algorithm.fill(v0, 1, 1, 1)
+
+block:
+  var v0 = [1]
+  algorithm.fill(v0, 1)
+
+block:
+  var v0 = [1]
+  algorithm.reverse(v0, 1, 1)
+
+block:
+  var v0 = [1]
+  algorithm.reverse(v0)
+
+block:
+  discard algorithm.reversed([1], 1, 1)
+
+block:
+  discard algorithm.reversed([1])
+
+block:
+  discard algorithm.binarySearch([1], 1, nil)
+
+block:
+  discard algorithm.binarySearch([1], 1)
+
+block:
+  discard algorithm.lowerBound([1], 1, nil)
+
+block:
+  discard algorithm.upperBound([1], 1)
+
+block:
+  var v0 = [1]
+  algorithm.sort(v0, nil)
+
+block:
+  var v0 = [1]
+  algorithm.sort(v0)
+
+block:
+  discard algorithm.sorted([1])
+
+block:
+  discard algorithm.isSorted([1])
+
+block:
+  discard algorithm.product([@[1]])
+
+block:
+  var v0 = [1]
+  discard algorithm.nextPermutation(v0)
+
+block:
+  var v0 = [1]
+  discard algorithm.prevPermutation(v0)
+
+block:
+  var v0 = [1]
+  discard algorithm.rotateLeft(v0, 1 .. 1, 1)
+
+block:
+  var v0 = [1]
+  discard algorithm.rotateLeft(v0, 1)
+
+block:
+  discard algorithm.rotatedLeft([1], 1)
+
+block:
+  discard strutils.isAlphaAscii('a')
+
+block:
+  discard strutils.isDigit('a')
+
+block:
+  discard strutils.toLowerAscii("a")
+
+block:
+  discard strutils.toUpperAscii('a')
+
+block:
+  discard strutils.capitalizeAscii("a")
+
+block:
+  discard strutils.normalize("a")
+
+block:
+  discard strutils.cmpIgnoreCase("a", "a")
+
+block:
+  discard strutils.split("a")
+
+block:
+  discard strutils.split("a", "a")
+
+block:
+  discard strutils.splitLines("a")
+
+block:
+  discard strutils.toBin(1, 1)
+
+block:
+  discard strutils.toHex(1, 1)
+
+block:
+  discard strutils.toHex("a")
+
+block:
+  discard strutils.intToStr(1)
+
+block:
+  discard strutils.parseInt("a")
+
+block:
+  discard strutils.parseBiggestUInt("a")
+
+block:
+  discard strutils.parseFloat("a")
+
+block:
+  discard strutils.parseBool("a")
+
+block:
+  discard strutils.repeat('a', 1)
+
+block:
+  discard strutils.align("a", 1)
+
+block:
+  discard strutils.indent("a", 1)
+
+block:
+  discard strutils.startsWith("a", "a")
+
+block:
+  var v0 : string = "a"
+  strutils.removeSuffix(v0, "a")
+
+block:
+  discard strutils.find("a", 'a')
+
+block:
+  discard strutils.contains("a", {'a'})
+
+block:
+  discard strutils.replace("a", "a")
+
+block:
+  discard strutils.replaceWord("a", "a")
+
+block:
+  discard strutils.join(["a"])
+
+block:
+  discard strutils.join([true])
+
+block:
+  discard strutils.formatFloat(1.0)
+
+block:
+  discard strutils.formatSize(l_int64_1)
+
+block:
+  discard strutils.`%`("a", ["a"])
+
+block:
+  discard strutils.strip("a")
+
+block:
+  discard strutils.escape("a")
+
+block:
+  discard strutils.unescape("a")
+
+block:
+  discard strutils.isEmptyOrWhitespace("a")
+
+block:
+  discard httpclient.code(new(Response))
+
+block:
+  discard httpclient.contentType(new(Response))
+
+block:
+  discard httpclient.contentLength(new(Response))
+
+block:
+  discard httpclient.lastModified(new(Response))
+
+block:
+  discard httpclient.body(new(Response))
+
+block:
+  discard httpclient.newProxy("a")
+
+block:
+  discard httpclient.newMultipartData()
+
+block:
+  discard httpclient.`$`(new(MultipartData))
+
+block:
+  var v0 = new(MultipartData)
+  httpclient.add(v0, "a", "a")
+
+block:
+  var v0 = new(MultipartData)
+  discard httpclient.add(v0, [("a", "a")])
+
+block:
+  discard httpclient.newMultipartData([("a", "a")])
+
+block:
+  var v0 = new(MultipartData)
+  discard httpclient.addFiles(v0, [("a", "a")])
+
+block:
+  var v0 = new(MultipartData)
+  httpclient.`[]=`(v0, "a", "a")
+
+block:
+  discard httpclient.newHttpClient()
+
+block:
+  discard httpclient.newAsyncHttpClient()
+
+block:
+  httpclient.close(new(HttpClient))
+
+block:
+  discard httpclient.getSocket(new(HttpClient))
+
+block:
+  discard httpclient.getSocket(new(AsyncHttpClient))
+
+block:
+  discard httpclient.request(new(HttpClient), "a", "a")
+
+block:
+  discard httpclient.head(new(HttpClient), "a")
+
+block:
+  discard httpclient.getContent(new(HttpClient), "a")
+
+block:
+  discard httpclient.postContent(new(HttpClient), "a")
+
+block:
+  httpclient.downloadFile(new(HttpClient), "a", "a")
+
+block:
+  discard tables.initTable()
+
+block:
+  discard tables.`[]`(Table[1, 1](), 1)
+
+block:
+  var v0 = Table[1, 1]()
+  tables.`[]=`(v0, 1, 1)
+
+block:
+  discard tables.hasKey(Table[1, 1](), 1)
+
+block:
+  discard tables.contains(Table[1, 1](), 1)
+
+block:
+  var v0 = Table[1, 1]()
+  discard tables.hasKeyOrPut(v0, 1, 1)
+
+block:
+  discard tables.getOrDefault(Table[1, 1](), 1, 1)
+
+block:
+  var v0 = Table[1, 1]()
+  discard tables.mgetOrPut(v0, 1, 1)
+
+block:
+  discard tables.len(Table[1, 1]())
+
+block:
+  var v0 = Table[1, 1]()
+  tables.add(v0, 1, 1)
+
+block:
+  var v0 = Table[1, 1]()
+  tables.del(v0, 1)
+
+block:
+  var v0 = Table[1, 1]()
+  var v1 = 1
+  discard tables.take(v0, 1, v1)
+
+block:
+  var v0 = Table[1, 1]()
+  tables.clear(v0)
+
+block:
+  discard tables.`$`(Table[1, 1]())
+
+block:
+  discard tables.`==`(Table[1, 1](), Table[1, 1]())
+
+block:
+  discard tables.indexBy(1, nil)
+
+block:
+  discard tables.newTable()
+
+block:
+  discard tables.newTableFrom(1, nil)
+
+block:
+  discard tables.initOrderedTable()
+
+block:
+  var v0 = OrderedTable[1, 1]()
+  tables.sort(v0, nil)
+
+block:
+  discard tables.initCountTable()
+
+block:
+  var v0 = CountTable[1]()
+  tables.inc(v0, 1)
+
+block:
+  discard tables.smallest(CountTable[1]())
+
+block:
+  discard tables.largest(CountTable[1]())
+
+block:
+  var v0 = CountTable[1]()
+  tables.merge(v0, CountTable[1]())
+
+block:
+  discard tables.newCountTable([1])
+
+block:
+  var v0 : int = 1
+  discard asyncdispatch.`==`(AsyncFD(v0), AsyncFD(v0))
+
+block:
+  discard asyncdispatch.newDispatcher()
+
+block:
+  asyncdispatch.setGlobalDispatcher(new(PDispatcher))
+
+block:
+  discard asyncdispatch.getGlobalDispatcher()
+
+block:
+  discard asyncdispatch.getIoHandler(new(PDispatcher))
+
+block:
+  var v0 : int = 1
+  asyncdispatch.register(AsyncFD(v0))
+
+block:
+  asyncdispatch.unregister(SelectEvent())
+
+block:
+  var v0 : int = 1
+  discard asyncdispatch.contains(new(PDispatcher), AsyncFD(v0))
+
+block:
+  discard asyncdispatch.hasPendingOperations()
+
+block:
+  asyncdispatch.poll()
+
+block:
+  asyncdispatch.runForever()
+
+block:
+  asyncdispatch.drain()
+
+block:
+  discard asyncdispatch.newAsyncEvent()
+
+block:
+  asyncdispatch.trigger(SelectEvent())
+
+block:
+  asyncdispatch.addEvent(SelectEvent(), nil)
+
+block:
+  asyncdispatch.addTimer(1, true, nil)
+
+block:
+  discard asyncdispatch.createAsyncNativeSocket()
+
+block:
+  var v0 : int = 1
+  asyncdispatch.closeSocket(AsyncFD(v0))
+
+block:
+  discard asyncdispatch.sleepAsync(1)
+
+block:
+  discard asyncdispatch.withTimeout(Future[1](), 1)
+
+block:
+  var v0 : int = 1
+  discard asyncdispatch.accept(AsyncFD(v0))
+
+block:
+  var v0 : int = 1
+  discard asyncdispatch.send(AsyncFD(v0), "a")
+
+block:
+  var v0 : int = 1
+  discard asyncdispatch.recvFromInto(AsyncFD(v0), nil, 1, cast[ptr SockAddr](0), cast[ptr SockLen](0))
+
+block:
+  var v0 : int = 1
+  discard asyncdispatch.sendTo(AsyncFD(v0), nil, 1, cast[ptr SockAddr](0), 1)
+
+block:
+  discard asyncdispatch.readAll(FutureStream["a"]())
+
+block:
+  asyncdispatch.callSoon(nil)
+
+block:
+  discard asyncdispatch.waitFor(Future[1]())
+
+block:
+  discard asyncdispatch.activeDescriptors()
+
+block:
+  discard asyncdispatch.maxDescriptors()
+
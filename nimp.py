@@ -1,15 +1,25 @@
 import argparse
+import cProfile
 import collections.abc
-import copy
+import concurrent.futures
+import contextlib
+import fcntl
+import functools
+import itertools
 import json
+import multiprocessing
 import pickle
 import re
+import resource
+import shutil
+import sqlite3
 import subprocess
 import tempfile
+import threading
 import time
-import uuid
+from bisect import bisect_right
 from hashlib import md5
-from os import path
+from os import getpid, makedirs, path, remove, replace
 
 # TODO
 #   - import statements when exporting JSON doc
@@ -26,53 +36,197 @@ This is just a PoC to export all Nim's functions from a library.
 # CHANGE ME!
 ###
 CODE_PATH = "/tmp/dummy_code.nim"
-CACHE_PATH = "/home/zapodef/.cache/generate_nim_rules"
+BINARY_PATH = "/tmp/dummy_nim"
+CACHE_PATH = "/home/zapodef/.cache/generate_nim_rules.db"
+PARSE_CACHE_PATH = "/home/zapodef/.cache/generate_nim_rules_parsed"
+VERDICTS_CACHE_PATH = "/home/zapodef/.cache/generate_nim_rules_verdicts"
+
+NIMP_VERSION = "0.2"
+# the parsings cached depend on the code parsing the documentation, which
+# may change without NIMP_VERSION: any change of NimP invalidates them
+with open(path.abspath(__file__), "rb") as f:
+    NIMP_DIGEST = md5(f.read()).hexdigest()
 
 safe_strip = lambda x: x.strip() if x else x
 
 parser = argparse.ArgumentParser("Produce dummy code to export all Nim functions from a library")
 parser.add_argument('nimpath', type=str, help="The path to Nim repertory")
 parser.add_argument('libs', type=str, nargs='+', help="The Nim libray to export")
+parser.add_argument('-o', '--output', dest='output', type=str, default=CODE_PATH, help="Where to write the generated code")
+parser.add_argument('--binary', dest='binary', type=str, default=BINARY_PATH, help="Where to build the binary, variants are suffixed with their flags")
+parser.add_argument('-w', '--workspace', dest='workspace', type=str, help="Where to write the intermediate files (documentation, logs, shards, nimcache), a new temporary directory removed at the end by default")
 parser.add_argument('-nc', '--no-cache', dest='no_cache', action="store_true", help="Don't use the cache when parsing types")
 parser.add_argument('-c', '--only-compile', dest='only_compile', action="store_true", help="Don't generate code, only compile")
+parser.add_argument('--resume', dest='resume', action="store_true", help="Don't generate code, resume the repair of the previous run from its checkpoint, without compiling again what was already compiled")
+parser.add_argument('-n', '--no-compile', dest='no_compile', action="store_true", help="Only generate code, don't compile it")
+parser.add_argument('-d', '--docs', dest='docs', type=str, help="Read the JSON documentation of the libs from this directory (eg. pure_strutils.json), instead of extracting it")
+parser.add_argument('--backend', dest='backend', choices=("nim", "fake"), default="nim", help="The compiler used, see COMPILERS (fake is a stand-in for Nim, to test the repair)")
+parser.add_argument('--fake-errors', dest='fake_errors', type=str, help="Lines of code failing with the fake backend, as a regular expression")
+parser.add_argument('--fake-silent', dest='fake_silent', type=str, help="Lines of code failing without location with the fake backend, when building, as a regular expression")
+parser.add_argument('--fake-latency', dest='fake_latency', type=float, default=0.0, help="Duration of each compilation with the fake backend, in seconds")
+parser.add_argument('--whole-docs', dest='whole_docs', action="store_true", help="Load the JSON documentation of each lib at once, instead of reading its entries one at a time, to compare the time and memory")
+parser.add_argument('--read-size', dest='read_size', type=int, default=1 << 16, help="Number of characters read at once from the JSON documentation, when reading its entries one at a time")
+parser.add_argument('--fixed-imports', dest='fixed_imports', action="store_true", help="Import the modules of FIXED_IMPORTS in all the code, instead of the modules needed by each proc call, to compare the compilation times")
+parser.add_argument('-s', '--scoped', dest='scoped', action="store_true", help="Call each proc in its own block, with short variable names, sharing the variables it doesn't modify")
 parser.add_argument('-u', '--update-cache-for', dest='update_cache', type=str, nargs='+', help="Update cache for the given")
+parser.add_argument('--merge-cache', dest='merge_cache', type=str, nargs='+', help="Merge the types of these caches, written by other runs, into the cache")
+parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help="Number of parallel jobs, to extract and parse the documentation and to compile the code split into as many shards (the code is generated sequentially)")
+parser.add_argument('-b', '--batch', dest='batch', action="store_true", help="Don't ask for unknown types: skip the procs using them, and list the types in the answers file")
+parser.add_argument('-a', '--answers', dest='answers', type=str, help="The answers for unknown types, as written by a batch run once filled in")
+parser.add_argument('-g', '--guess-objects', dest='guess_objects', action="store_true", help="Consider unknown capitalized types as objects")
+parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=100, help="Number of procs per module when compiling, so that repairing a proc only recompiles its module (0 to compile a single module)")
+parser.add_argument('-v', '--verbose', dest='verbose', action="count", default=0, help="Dump each proc and its code (-v), and its context (-vv)")
+parser.add_argument('--metrics', dest='metrics', type=str, help="Write the time spent in each stage of the run to this JSON file")
+parser.add_argument('--profile', dest='profile', type=str, help="Profile the run with cProfile, and write the stats to this file")
+parser.add_argument('-m', '--matrix', dest='matrix', action="store_true", help="Also build the code with every optimisation, see MATRIX")
+parser.add_argument('--variant', dest='variants', type=str, action="append", help="Also build the code with these flags (eg. --variant='--opt:size -d:useMalloc'), can be repeated")
 args = parser.parse_args()
+CODE_PATH = args.output
+BINARY_PATH = args.binary
+if args.batch and not args.answers:
+    args.answers = path.splitext(CODE_PATH)[0] + "_answers.json"
+MANIFEST_PATH = path.splitext(CODE_PATH)[0] + "_manifest.json"
+# the progress of the repair, kept until the run ends
+CHECKPOINT_PATH = path.splitext(CODE_PATH)[0] + "_checkpoint.pickle"
+
+# every intermediate file of the run lives in its own workspace, so that
+# many runs can share the host
+WORKSPACE = args.workspace or tempfile.mkdtemp(prefix="nimp_")
+# the workspace in the paths reported by the compiler, which may be prefixed
+# (eg. /tmp is /private/tmp on macOS)
+WORKSPACE_PREFIX = re.compile(rf"\S*?{re.escape(path.abspath(WORKSPACE))}/")
+makedirs(WORKSPACE, exist_ok=True)
+print(f"# Workspace: {WORKSPACE}")
+
+if args.profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+# print the values when verbose enough
+def log(*values, level=1):
+    if args.verbose >= level:
+        print(*values)
+
+# time spent in each stage of the run, as {stage: {"wall", "cpu", "count"}},
+# in total and for each lib or repair, as {lib: {stage: ...}}
+# NB: cpu is the time of the thread running the stage, excluding the
+# compilers, which are reported as a whole at the end
+stage_metrics = dict()
+breakdown_metrics = collections.defaultdict(dict)
+metrics_lock = threading.Lock()
+
+# account the time spent in the block to the given stage
+@contextlib.contextmanager
+def stage(name, key=None, count=1):
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        with metrics_lock:
+            for m in [stage_metrics] + ([breakdown_metrics[key]] if key else []):
+                entry = m.setdefault(name, {"wall": 0.0, "cpu": 0.0, "count": 0})
+                entry["wall"] += wall
+                entry["cpu"] += cpu
+                entry["count"] += count
 
 NIMPATH = args.nimpath
 nimbin = path.join(NIMPATH, "bin/nim")
 if args.no_cache:
-    CACHE_PATH = tempfile.NamedTemporaryFile().name
+    CACHE_PATH = path.join(WORKSPACE, "cache.db")
+    PARSE_CACHE_PATH = path.join(WORKSPACE, "cache_parsed")
+    VERDICTS_CACHE_PATH = path.join(WORKSPACE, "cache_verdicts")
+
+# used to key the caches
+# NB: Nim is not needed to generate code from recorded documentation, nor
+# to repair it with the fake backend, whose verdicts are kept apart, but
+# the documentation is extracted by Nim whatever the backend
+nim_version = args.backend
+docs_nim_version = None
+if (args.backend == "nim" or not args.docs) and path.exists(nimbin):
+    docs_nim_version = subprocess.run([nimbin, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.split("\n")[0]
+    if args.backend == "nim":
+        nim_version = docs_nim_version
 
 # TODO dirty, not to indent one more level
-if args.only_compile:
+if args.only_compile or args.resume:
     args.libs = list()
 
-def deep_update(d, u):
-    # from https://stackoverflow.com/questions/3232943/update-value-of-a-nested-dictionary-of-varying-depth
-    for k, v in u.items():
-        if isinstance(v, collections.abc.Mapping):
-            d[k] = deep_update(d.get(k, {}), v)
-        else:
-            d[k] = v
-    return d
-
-def traceback(error_log):
-    # return the number of the line causing an issue
-    m = re.compile(rf"^{CODE_PATH}\(([0-9]+), ([0-9]+)\)")
-    for line in error_log.split("\n")[::-1]:
-        r = m.search(line)
+# write a cache file atomically, so that an interrupted run can't corrupt it
+# NB: the temporary file is specific to the process, as caches are shared
+def dump_cache(obj, file_path):
+    tmp_path = f"{file_path}.{getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(pickle.dumps(obj))
+    replace(tmp_path, file_path)
+
+# hold an exclusive lock on a cache file, so that concurrent runs sharing
+# it don't lose each other's updates between reading and writing it
+@contextlib.contextmanager
+def locked(file_path):
+    with open(file_path + ".lock", 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+# read a cache file, or return None if there is none
+def load_cache(file_path):
+    if not path.exists(file_path):
+        return None
+    with open(file_path, 'rb') as f:
+        return pickle.load(f)
+
+# the checkpoint of the previous run, when resuming it
+checkpoint = None
+if args.resume:
+    checkpoint = load_cache(CHECKPOINT_PATH)
+    if checkpoint is None:
+        print(f"ERROR: no checkpoint to resume from, {CHECKPOINT_PATH} does not exist")
+        exit(1)
+    # the repairs done depend on how the code was split
+    for option in ("jobs", "chunk_size"):
+        if checkpoint[option] != getattr(args, option):
+            print(f"ERROR: the checkpoint was written with --{option.replace('_', '-')}={checkpoint[option]}, resume with the same value")
+            exit(1)
+
+def traceback(error_log, code_paths=(CODE_PATH,)):
+    # return every (file, line number, traceback) causing an issue in one of
+    # our files, as a single compiler pass may report many errors (see --errorMax)
+    # errors inside generics are reported in the library code, after
+    # "instantiation from here" lines pointing to our code: the last line
+    # of ours seen before an "Error:" is the culprit
+    # NB: match on the file name only, as the reported path may differ
+    # from CODE_PATH (eg. /tmp is /private/tmp on macOS)
+    names = {path.basename(k): k for k in code_paths}
+    m_ours = re.compile(rf"(?:^|/)({'|'.join(map(re.escape, names))})\(([0-9]+), ([0-9]+)\)")
+    m_location = re.compile(r"^\S.*\([0-9]+, [0-9]+\) ")
+    errors = list()
+    lines = error_log.split("\n")
+    chunk_start, culprit = None, None
+    for i, line in enumerate(lines):
+        if " Hint: " in line or " Warning: " in line:
+            continue
+        r = m_ours.search(line)
         if r:
-            return int(r.group(1)), line
-    return None, None
+            if culprit is None:
+                chunk_start = i
+            culprit = (names[r.group(1)], int(r.group(2)))
+        if "Error:" in line and culprit is not None:
+            # the error message may span on the following lines
+            end = i + 1
+            while end < len(lines) and lines[end] and not m_location.match(lines[end]):
+                end += 1
+            errors.append((*culprit, "\n".join(lines[chunk_start:end])))
+            chunk_start, culprit = None, None
+    return errors
 
 
 # context will be used to share contextual elements of the library
 # here we have a meta context, that will be the base template for context
 meta_context = {
     # references
-    "ref": list(),
+    "ref": set(),
     # objects
-    "objects" : list(),
+    "objects" : set(),
     # send one type to another
     "redirect_to": {
         "Callback": "proc",
@@ -85,83 +239,261 @@ meta_context = {
     "give_value": dict(),
 }
 
-# load meta context from cache
-if path.exists(CACHE_PATH):
-    with open(CACHE_PATH, 'rb') as f:
-        cache = pickle.load(f)
-    deep_update(meta_context, cache)
-
-if args.update_cache:
-    for remove_type in args.update_cache:
-        for s in meta_context:
-            while remove_type in meta_context[s]:
-                if type(meta_context[s]) == list:
-                    meta_context[s].remove(remove_type)
-                elif type(meta_context[s]) == dict:
-                    meta_context[s].pop(remove_type)
+# registries of type names, as sets
+REGISTRIES = ("ref", "objects")
+
+# the types learnt by all runs are kept in a store, as rows of (registry,
+# type name, value, lib), where lib is None for answers
+# NB: rows are only appended or replaced, unless a type is unlearnt, and the
+# store can be shared by concurrent runs, or merged from other runs, or
+# written by the threads repairing the shards
+store = sqlite3.connect(CACHE_PATH, timeout=60, check_same_thread=False)
+store.executescript("""
+CREATE TABLE IF NOT EXISTS types (
+    registry TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    lib TEXT,
+    PRIMARY KEY (registry, name)
+);
+CREATE INDEX IF NOT EXISTS types_by_name ON types (name);
+""")
+
+# older caches were pickles of meta context
+LEGACY_CACHE_PATH = path.splitext(CACHE_PATH)[0]
+if path.exists(LEGACY_CACHE_PATH) and not store.execute("SELECT 1 FROM types LIMIT 1").fetchone():
+    with open(LEGACY_CACHE_PATH, 'rb') as f:
+        legacy = pickle.load(f)
+    with store:
+        for registry, entries in legacy.items():
+            values = entries if isinstance(entries, dict) else dict.fromkeys(entries)
+            store.executemany("INSERT OR IGNORE INTO types VALUES (?, ?, ?, NULL)", ((registry, k, v) for k, v in values.items()))
+
+# the types already in the store are kept
+for other_path in args.merge_cache or ():
+    store.execute("ATTACH DATABASE ? AS other", (other_path,))
+    with store:
+        store.execute("INSERT OR IGNORE INTO types SELECT * FROM other.types")
+    store.execute("DETACH DATABASE other")
+
+# types learnt since the last save, as rows of the store
+learnt_types = list()
+# the lib declaring each type, as {type name: lib}, when known
+type_owners = dict()
+
+# add a type to meta context, and to the store at the next save
+def learn(registry, type_name, value=None, lib=None):
+    if registry in REGISTRIES:
+        meta_context[registry].add(type_name)
+    else:
+        meta_context[registry][type_name] = value
+    if lib:
+        type_owners[type_name] = lib
+    else:
+        type_owners.pop(type_name, None)
+    learnt_types.append((registry, type_name, value, lib))
+
+# remove a type from meta context and from the store, whatever its registry
+def unlearn(type_name):
+    with store:
+        store.execute("DELETE FROM types WHERE name = ?", (type_name,))
+    learnt_types[:] = [k for k in learnt_types if k[1] != type_name]
+    type_owners.pop(type_name, None)
+    for s in meta_context:
+        if type(meta_context[s]) == set:
+            meta_context[s].discard(type_name)
+        elif type(meta_context[s]) == dict:
+            meta_context[s].pop(type_name, None)
+
+for remove_type in args.update_cache or ():
+    unlearn(remove_type)
+
+# append the types learnt to the store
+def save_context():
+    with store:
+        store.executemany("INSERT OR REPLACE INTO types VALUES (?, ?, ?, ?)", learnt_types)
+    learnt_types.clear()
+
+# names already looked up in the store, and the number of types found
+recalled_names = set()
+recalled_types = 0
+
+# add the types of the given names to meta context, as learnt by previous
+# runs, unless they are already known
+# return whether any was added
+def recall(*type_names):
+    global context_generation, recalled_types
+    type_names = set(type_names) - recalled_names
+    if not type_names:
+        return False
+    recalled_names.update(type_names)
+    recalled = False
+    rows = store.execute(f"SELECT registry, name, value, lib FROM types WHERE name IN ({', '.join('?' * len(type_names))})", tuple(type_names))
+    for registry, type_name, value, lib in rows:
+        if registry not in meta_context or type_name in meta_context[registry]:
+            continue
+        if registry in REGISTRIES:
+            meta_context[registry].add(type_name)
+        else:
+            meta_context[registry][type_name] = value
+        if lib:
+            type_owners[type_name] = lib
+        recalled = True
+        recalled_types += 1
+    if recalled:
+        context_generation += 1
+    return recalled
+
+# return a context layered over the given one, instead of a copy of it:
+# lookups fall back to the base context, while writes made to the
+# mappings of the layer (eg. the generics of a proc) don't alter it
+# NB: registries are shared with the base context
+def layer_context(base):
+    context = dict()
+    for k, v in base.items():
+        if isinstance(v, collections.abc.Mapping):
+            context[k] = collections.ChainMap(dict(), v)
+        else:
+            context[k] = v
+    return context
 
 # variables used when calling proc
 meta_variables = """
 type MyEnum = enum first = "1st", second, third = "3rd"
 """
 
-# Produced final code
-procs_calls_code = """
-import os, tables, strutils, times, heapqueue, lists, options, asyncstreams, nativesockets, net, deques
-"""
+# modules imported by the blocks using types of unknown libs (eg. answers)
+FIXED_IMPORTS = ("os", "tables", "strutils", "times", "heapqueue", "lists", "options", "asyncstreams", "nativesockets", "net", "deques")
+
+# return the module to import to use a lib, or None if it can't be imported
+# as it is already included (eg. system.nim)
+def lib_module(nimlib):
+    return nimlib.split("/")[-1] if nimlib.startswith("pure/") else None
+
+# return the lines importing the given modules, the fixed imports on a
+# single line when all of them are needed, then one line per module
+def import_lines(modules):
+    modules = list(dict.fromkeys(modules))
+    lines = list()
+    if all(k in modules for k in FIXED_IMPORTS):
+        lines.append("import " + ", ".join(FIXED_IMPORTS))
+        modules = [k for k in modules if k not in FIXED_IMPORTS]
+    return lines + [f"import {k}" for k in modules]
+
+# Produced final code: a header with the types, then one block of code per
+# proc call, emitted as they are produced, each one along with the modules
+# it imports
+header_lines = meta_variables.strip("\n").split("\n")
+blocks = list()
+block_imports = list()
+# the proc called by each block, as (lib, index of the proc in the lib,
+# declaration, generics, arguments), to generate the block again
+sources = list()
+
+# closing delimiter of each opening one
+DELIMITERS = {"(": ")", "[": "]", "{": "}"}
+
+# return whether raw[i] starts a string, char or backtick literal (eg. `[]=`)
+def starts_literal(raw, i):
+    if raw[i] == "'" and i > 0 and (raw[i-1].isalnum() or raw[i-1] == "_"):
+        return False  # type suffix of a literal, eg. 0'u8
+    return raw[i] in "\"'`"
+
+# return the index of the last character of the literal starting at raw[start]
+# raise a ValueError giving the position of an unterminated literal
+def scan_literal(raw, start):
+    char = raw[start]
+    if raw.startswith('"""', start):
+        i = raw.find('"""', start + 3) + 2
+    else:
+        i = start + 1
+        while i < len(raw) and raw[i] != char:
+            if raw[i] == "\\" and char != "`":
+                i += 1
+            i += 1
+    if i < start or i >= len(raw):
+        raise ValueError(f"unterminated literal at position {start}")
+    return i
+
+# scan a balanced group starting at raw[start], in a single pass
+# nested parentheses, brackets and braces must be balanced as well, while
+# literals are skipped
+# return the index right after the group
+# raise a ValueError giving the position of malformed input
+def scan_group(raw, start):
+    expected = list()
+    i = start
+    while i < len(raw):
+        char = raw[i]
+        if char in DELIMITERS:
+            expected.append(DELIMITERS[char])
+        elif char in ")]}":
+            if not expected or expected.pop() != char:
+                raise ValueError(f"unexpected {char!r} at position {i}")
+            if not expected:
+                return i + 1
+        elif starts_literal(raw, i):
+            i = scan_literal(raw, i)
+        i += 1
+    raise ValueError(f"unclosed {raw[start]!r} at position {start}")
+
+# split raw at the separators found outside of groups and literals, with
+# the same cursor as scan_group
+# eg. "a, b[c, d]; e = ';'" gives ["a", "b[c, d]", "e = ';'"], and the
+# alternatives of a type class "int | seq[int | float]" give ["int", "seq[int | float]"]
+# raise a ValueError giving the position of malformed input
+def split_balanced(raw, separators=",;"):
+    parts = list()
+    i = start = 0
+    while i < len(raw):
+        char = raw[i]
+        if char in DELIMITERS:
+            i = scan_group(raw, i)
+            continue
+        if char in separators:
+            parts.append(raw[start:i].strip())
+            start = i + 1
+        elif starts_literal(raw, i):
+            i = scan_literal(raw, i)
+        i += 1
+    parts.append(raw[start:].strip())
+    return parts
+
+PROC_HEADER = re.compile(r"(?P<proc_or_func>proc|func) (?P<name>[^\(\*\[`]+|`[^`]+`)(?P<exported>\*?)(?=.)", re.DOTALL)
+PROC_TAIL = re.compile(r"(?:: (?P<return_type>[^{}]+))?(?P<pragmas> *{\. *(.*?) *\.})?$", re.DOTALL)
 
 # parse a proc declaration, and return a dict of what it found
+# if it could not be parsed, "matched" is False and "error" may tell why
 def parse_proc_declaration(raw):
     res = {'matched': True}
-
-    def consume_prefix(regex):
-        # keeps the "keep" group
-        # will put any other named group into res
-        nonlocal raw
-        nonlocal res
-        m = re.search(r'^%s' % regex, raw, re.DOTALL)
-        if not m:
-            res['matched'] = False
-            raw = ""
-        else:
-            groups = m.groupdict()
-            raw = groups.pop("keep", "")
-            res.update(groups)
-
-    def extract_group(open_delimiter, close_delimiter, keep_root_delimiters = False):
-        # extract balanced groups eg. in parentheses, what can hardly
-        # be achieved through regular expression
-        # eg.  open_delimitier = "(" and close_delimiter = ")" will match a
-        #      balanced parenthesed group starting at raw[0]
-        # NOTE that an empty group (the open_delimitier delimiter was not found)
-        #      is a valid group
-        # if keep_root_delimiters is False, return "content" instead of "(content)"
-        nonlocal raw
-        if raw[0] != open_delimiter:
-            return None
-
-        accu = open_delimiter
-        raw = raw[1:]
-        balance = 1
-
-        while balance != 0:
-            char = raw[0]
-            if char == open_delimiter:
-                balance += 1
-            elif char == close_delimiter:
-                balance -= 1
-            accu += char
-            raw = raw[1:]
-
-        if not keep_root_delimiters:
-            accu = accu[1:-1]
-
-        return accu
-
-    consume_prefix(r"(?P<proc_or_func>proc|func) (?P<name>[^\(\*\[`]+|`[^`]+`)(?P<exported>\*?)(?P<keep>.+)")
-    res["generics"] = extract_group("[", "]")
-    res["arguments"] = extract_group("(", ")")
-    consume_prefix(r"(?:: (?P<return_type>[^{}]+))?(?P<pragmas> *{\. *(.*?) *\.})?$")
+    m = PROC_HEADER.match(raw)
+    if not m:
+        res['matched'] = False
+        return res
+    res.update(m.groupdict())
+    pos = m.end()
+
+    # generics and arguments are balanced groups, which can hardly be
+    # matched through regular expressions
+    # NOTE that a missing group is valid, and gives None
+    for key, delimiter in (("generics", "["), ("arguments", "(")):
+        res[key] = None
+        if raw.startswith(delimiter, pos):
+            try:
+                end = scan_group(raw, pos)
+            except ValueError as e:
+                res['matched'] = False
+                res['error'] = str(e)
+                return res
+            res[key] = raw[pos+1:end-1]
+            pos = end
+
+    m = PROC_TAIL.match(raw, pos)
+    if not m:
+        res['matched'] = False
+        res['error'] = f"unexpected {raw[pos:pos+10]!r} at position {pos}"
+        return res
+    res.update(m.groupdict())
     return res
 
 # takes a raw arguments string
@@ -182,7 +514,8 @@ def parse_args(raw):
         default_value_declared = False
 
         if "=" in e:
-            e, e_val = e.split("=")
+            # the default value may contain "=" as well
+            e, e_val = e.split("=", maxsplit=1)
             default_value_declared = True
 
         if ':' in e:
@@ -219,119 +552,298 @@ def parse_args(raw):
         return res
 
     accu = []
-    # TODO (FIXME) don't match
-    #  sep = ", "
-    li_args = list(re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", raw))
+    li_args = split_balanced(raw)
     while li_args:
         _process(li_args, accu)
     return accu
 
+# a type name split into its head and generics
+# eg. "Table[string, seq[int]]" gives
+#     TypeExpression("Table", "string, seq[int]", ("string", "seq[int]"))
+# and "int" gives TypeExpression("int", None, ())
+TypeExpression = collections.namedtuple("TypeExpression", ["head", "generics", "args"])
+GENERIC_TYPE = re.compile(r'^(?P<name>[^\[]+)\[(?P<generics>.*)\]$')
+
+@functools.lru_cache(maxsize=None)
+def parse_type_name(from_type):
+    matching = GENERIC_TYPE.match(from_type)
+    if not matching:
+        return TypeExpression(from_type, None, ())
+    generics = matching.group("generics")
+    return TypeExpression(matching.group("name"), generics, tuple(split_balanced(generics)))
+
+# modifiers stripped from a type, in this order
+TYPE_MODIFIERS = ("var", "not", "distinct", "owned", "ptr")
+
+# return the modifiers of a type, and the type without them
+# eg. "var seq[int] | int" gives (("var",), "seq[int]")
+@functools.lru_cache(maxsize=None)
+def parse_modifiers(from_type):
+    if "|" in from_type:
+        # we take the 1st possibility
+        from_type = split_balanced(from_type, "|")[0]
+    modifiers = list()
+    for modifier in TYPE_MODIFIERS:
+        if from_type.startswith(modifier + " "):
+            modifiers.append(modifier)
+            from_type = from_type[len(modifier)+1:]
+            if modifier == "not":
+                # we use bool by default except when the type is "not bool"
+                from_type = "int" if from_type == "bool" else "bool"
+    return tuple(modifiers), from_type
+
+# values of builtin types, as {type: (declare the type, value)}
+# when the type is declared, the variable will use it as type
+BUILTIN_VALUES = {
+    **dict.fromkeys((
+        "int", "int8", "int16", "int32", "int64", "uint", "uint8", "uint16", "uint32", "uint64",
+        "cint", "cshort", "clong", "clonglong", "byte", "Natural", "Positive", "BiggestInt", "BiggestUInt",
+        "SomeSignedInt", "SomeUnsignedInt", "SomeInteger", "SomeOrdinal", "SomeNumber",
+    ), (True, '1')),
+    **dict.fromkeys(("float", "float32", "float64", "cfloat", "SomeFloat", "BiggestFloat"), (True, '1.0')),
+    "bool": (True, 'true'),
+    "char": (True, "'a'"),
+    "string": (True, '"a"'),
+    "cstring": (True, '"a"'),
+    "void": (False, 'void'),  # sometimes used in generics
+    "pointer": (True, 'nil'),
+    "enum": (False, 'MyEnum.first'),
+    "typedesc": (False, 'int'),
+}
+# the same as patterns, tried in order for the types not found above
+# NB: some of them only match a prefix of the type
+BUILTIN_PATTERNS = [
+    (re.compile(r'^[uc]?int[0-9]*|c(short|long|longlong)|byte|Natural|Positive|BiggestU?Int|SomeSignedInt|SomeUnsignedInt|SomeInteger|SomeOrdinal|SomeNumber$'), True, '1'),
+    (re.compile(r'^c?float[0-9]*|SomeFloat|BiggestFloat$'), True, '1.0'),
+    (re.compile(r'^bool$'), True, 'true'),
+    (re.compile(r'^char$'), True, "'a'"),
+    (re.compile(r'^c?string$'), True, '"a"'),
+    (re.compile(r'^void$'), False, 'void'),
+    (re.compile(r'^pointer'), True, 'nil'),
+    (re.compile(r'^enum$'), False, 'MyEnum.first'),
+    (re.compile(r'^typedesc$'), False, 'int'),
+]
+
+def resolve_slice(expression, dict_vars, context):
+    val = get_param_value(expression.generics, dict_vars, context)
+    return (None, f"{val} .. {val}")
+
+def resolve_hslice(expression, dict_vars, context):
+    # there should be exactly two types to extract
+    t1, t2 = expression.args
+    val1 = get_param_value(t1, dict_vars, context)
+    val2 = get_param_value(t2, dict_vars, context)
+    return (None, f"{val1} .. {val2}")
+
+def resolve_seq(expression, dict_vars, context):
+    # we fill the list with the necessary values for each type
+    values_li = (get_param_value(k, dict_vars, context) for k in expression.args)
+    return (None, '@[%s]' % (", ".join(values_li)))
+
+def resolve_set(expression, dict_vars, context):
+    values_li = (get_param_value(k, dict_vars, context) for k in expression.args)
+    return (None, '{%s}' % (", ".join(values_li)))
+
+def resolve_open_array(expression, dict_vars, context):
+    values_li = (get_param_value(k, dict_vars, context) for k in expression.args)
+    return (None, '[%s]' % (", ".join(values_li)))
+
+def resolve_tuple(expression, dict_vars, context):
+    # eg. tuple[name, content: string]
+    args = parse_args(expression.generics)
+    types_in_tuple = (a[1] for a in args)
+    values_li = (get_param_value(k, dict_vars, context) for k in types_in_tuple)
+    return (None, '(%s)' % (", ".join(values_li)))
+
+# resolvers of generic types, by head
+TYPE_RESOLVERS = {
+    "Slice": resolve_slice,
+    "HSlice": resolve_hslice,
+    "seq": resolve_seq,
+    "set": resolve_set,
+    "openArray": resolve_open_array,
+    "tuple": resolve_tuple,
+}
+
+# lookups in the context, for each registry, reported at the end of the run
+registry_lookups = collections.Counter()
+
+# return whether a type name is in one of the context registries
+def is_registered(type_name, registry, context):
+    registry_lookups[registry] += 1
+    return type_name in context[registry]
+
+# declarations already resolved, along with the types they use, as
+# {(type, generation, layer): (declaration, types)}
+# only declarations that neither use variables nor the history are kept
+resolved_declarations = dict()
+# incremented whenever meta_context changes
+context_generation = 0
+# incremented whenever a declaration uses variables or the history
+impure_declarations = 0
+
+# return what is specific to the context of a proc (see layer_context),
+# or None if the context is not layered over meta_context
+def context_layer(context):
+    layer = list()
+    for registry in meta_context:
+        mapping = context[registry]
+        if isinstance(mapping, collections.ChainMap):
+            if len(mapping.maps) != 2 or mapping.maps[1] is not meta_context[registry]:
+                return None
+            layer.append(tuple(mapping.maps[0].items()))
+        elif mapping is not meta_context[registry]:
+            return None
+    return tuple(layer)
+
 # return a variable declaration as a tuple (declaration_type, value)
 # NOTE that declaration_type may be different from from_type,
 # as eg. "T" will be transformed to "int". It takes either a string or None
 # as value. When using a string, the variable will be declared with the string
 # as type. When using None, no type will be specified and Nim will infer it.
 def declare_var(from_type, dict_vars, context):
-    if from_type in context["give_value"]:
+    used = context["used"]
+    key = context_layer(context)
+    if key is not None:
+        key = (from_type, context_generation, key)
+        if key in resolved_declarations:
+            declaration, used_types = resolved_declarations[key]
+            used.extend(used_types)
+            return declaration
+
+    impure_before, used_before = impure_declarations, len(used)
+    declaration = resolve_declaration(from_type, dict_vars, context)
+    if key is not None and impure_declarations == impure_before:
+        resolved_declarations[key] = (declaration, tuple(used[used_before:]))
+    return declaration
+
+# the types found in the context are added to context["used"], to import
+# the libs declaring them
+def resolve_declaration(from_type, dict_vars, context):
+    if is_registered(from_type, "give_value", context):
+        context["used"].append(from_type)
         return (None, context["give_value"][from_type])
-    elif from_type in context["redirect_to"]:
+    elif is_registered(from_type, "redirect_to", context):
+        context["used"].append(from_type)
         return (None, get_param_value(context["redirect_to"][from_type], dict_vars, context))
-    elif from_type in context["ref"]:
+    elif is_registered(from_type, "ref", context):
+        context["used"].append(from_type)
         return (None, f'new({from_type})')
-    elif from_type in context["objects"]:
+    elif is_registered(from_type, "objects", context):
+        context["used"].append(from_type)
         return (None, f"{from_type}()")
-    elif re.match(r'^[uc]?int[0-9]*|c(short|long|longlong)|byte|Natural|Positive|BiggestU?Int|SomeSignedInt|SomeUnsignedInt|SomeInteger|SomeOrdinal|SomeNumber$', from_type):
-        return (from_type, '1')
-    elif re.match(r'^c?float[0-9]*|SomeFloat|BiggestFloat$', from_type):
-        return (from_type, '1.0')
-    elif re.match(r'^bool$', from_type):
-        return (from_type, 'true')
-    elif re.match(r'^char$', from_type):
-        return (from_type, "'a'")
-    elif re.match(r'^c?string$', from_type):
-        return (from_type, '"a"')
-    elif re.match(r'^void$', from_type):
-        return (None, 'void')  # sometimes used in generics
-    elif re.match(r'^pointer', from_type):
-        return (from_type, 'nil')
-    elif re.match(r'^enum$', from_type):
-        return (None, 'MyEnum.first')
-    elif re.match(r'^typedesc$', from_type):
-        return (None, 'int')
-    elif re.match(r'^Slice\[(.*)\]$', from_type):
-        other = re.match(r'^Slice\[(.*)\]$', from_type).group(1)
-        val = get_param_value(other, dict_vars, context)
-        return (None, f"{val} .. {val}")
-    elif re.match(r'^HSlice\[(.*)\]$', from_type):
-        other = re.match(r'^HSlice\[(.*)\]$', from_type).group(1)
-        # there should be exactly two types to extract
-        t1, t2 = re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", other)
-        val1 = get_param_value(t1, dict_vars, context)
-        val2 = get_param_value(t2, dict_vars, context)
-        return (None, f"{val1} .. {val2}")
-    elif re.match(r'^seq\[(.*)\]$', from_type):
-        other = re.match(r'^seq\[(.*)\]$', from_type).group(1)
-        # we fill the list with the necessary values for each type
-        values_li = (get_param_value(k, dict_vars, context) for k in re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", other))
-        return (None, '@[%s]' % (", ".join(values_li)))
-    elif re.match(r'^set\[(.*)\]$', from_type):
-        other = re.match(r'^set\[(.*)\]$', from_type).group(1)
-        # we fill the list with the necessary values for each type
-        values_li = (get_param_value(k, dict_vars, context) for k in re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", other))
-        return (None, '{%s}' % (", ".join(values_li)))
-    elif re.match(r'^(?:openArray)\[(.*)\]$', from_type):
-        other = re.match(r'^(?:openArray)\[(.*)\]$', from_type).group(1)
-        # we fill the list with the necessary values for each type
-        values_li = (get_param_value(k, dict_vars, context) for k in re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", other))
-        return (None, '[%s]' % (", ".join(values_li)))
-    elif re.match(r'^tuple\[(.*)\]$', from_type):
-        other = re.match(r'^tuple\[(.*)\]$', from_type).group(1)
-        # eg. tuple[name, content: string]
-        args = parse_args(other)
-        types_in_tuple = (a[1] for a in args)
-        values_li = (get_param_value(k, dict_vars, context) for k in types_in_tuple)
-        return (None, '(%s)' % (", ".join(values_li)))
-    elif re.match(r'^proc( |$)', from_type):
+
+    builtin = BUILTIN_VALUES.get(from_type)
+    if not builtin:
+        builtin = next(((declared, value) for pattern, declared, value in BUILTIN_PATTERNS if pattern.match(from_type)), None)
+    if builtin:
+        declared, value = builtin
+        return (from_type if declared else None, value)
+
+    expression = parse_type_name(from_type)
+    if expression.generics is not None and expression.head in TYPE_RESOLVERS:
+        return TYPE_RESOLVERS[expression.head](expression, dict_vars, context)
+    elif from_type.split(" ")[0] == "proc":
         return (None, 'nil')
+
+    # TODO bad handling of generics
+    # eg. when 'T' is expected to be float64 as per proc's declaration
+    # maybe the type is a sth we know with generics?
+    if expression.generics is not None:
+        name = expression.head
+        if is_registered(name, "ref", context) or is_registered(name, "objects", context):
+            context["used"].append(name)
+            values_li = (get_param_value(k, dict_vars, context) for k in expression.args)
+            if is_registered(name, "ref", context):
+                return (None, 'new {}[{}]'.format(name, ", ".join(values_li)))
+            elif is_registered(name, "objects", context):
+                return (None, '{}[{}]()'.format(name, ", ".join(values_li)))
+        elif is_registered(name, "redirect_to", context):
+            # onyl a dirty workaround for lonely generic [T]
+            if len(expression.args) == 1:
+                context["used"].append(name)
+                generic_T = expression.args[0]
+                redirect_to = context["redirect_to"][name].format(T=generic_T)
+                return (None, get_param_value(redirect_to, dict_vars, context))
+
+    # if we arrive here, we have an unmatched type, unless a previous run
+    # learnt it
+    if recall(from_type, expression.head):
+        return declare_var(from_type, dict_vars, context)
+    if answers.get(from_type):
+        ask = answers[from_type]
+    elif args.guess_objects and from_type[0].isupper():
+        print(f"# Guessing type {from_type} is an object")
+        ask = '!o'
+    elif args.batch:
+        raise UnresolvedType(from_type)
     else:
-        # TODO bad handling of generics
-        # eg. when 'T' is expected to be float64 as per proc's declaration
-        # maybe the type is a sth we know with generics?
-        matching = re.match(r'^(?P<name>[^\[]+)\[(?P<generics>.*)\]$', from_type)
-        if matching:
-            name = matching.group("name")
-            generic_raw = matching.group("generics")
-            if name in context["ref"] or name in context["objects"]:
-                li_generics = re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", generic_raw)
-                values_li = (get_param_value(k, dict_vars, context) for k in li_generics)
-                if name in context["ref"]:
-                    return (None, 'new {}[{}]'.format(name, ", ".join(values_li)))
-                elif name in context["objects"]:
-                    return (None, '{}[{}]()'.format(name, ", ".join(values_li)))
-            elif name in context["redirect_to"]:
-                # onyl a dirty workaround for lonely generic [T]
-                li_generics = re.split(r"[,;]\s*(?![^()\[\]{}]*(?:\)|\]|\}))", generic_raw)
-                if len(li_generics) == 1:
-                    generic_T = li_generics[0]
-                    redirect_to = context["redirect_to"][name].format(T=generic_T)
-                    return (None, get_param_value(redirect_to, dict_vars, context))
-
-        # if we arrive here, we have an unmatched type
         # interactive mode
         ask = input(f"What value should be used for type {from_type}? ([!r]ef, [!o]bject) ")
-        global meta_context
-        if ask == '!r':
-            meta_context["ref"].append(from_type.split("[")[0])
-            context["ref"].append(from_type.split("[")[0])
-        elif ask == '!o':
-            meta_context["objects"].append(from_type.split("[")[0])
-            context["objects"].append(from_type.split("[")[0])
-        else:
-            meta_context["give_value"][from_type] = ask
-            context["give_value"][from_type] = ask
-
-        # and run it again
-        return declare_var(from_type, dict_vars, context)
+        answers[from_type] = ask
+    # NB: context is layered over meta_context (see layer_context),
+    # so it sees the answer as well
+    global meta_context, context_generation
+    if ask == '!r':
+        learn("ref", from_type.split("[")[0])
+    elif ask == '!o':
+        learn("objects", from_type.split("[")[0])
+    else:
+        learn("give_value", from_type, ask)
+    context_generation += 1
+
+    # and run it again
+    return declare_var(from_type, dict_vars, context)
+
+# raised in batch mode, when a type is unknown, or with every unknown type
+# of a proc (see generate_block)
+class UnresolvedType(Exception):
+    pass
+
+# answers for unknown types, as {type: answer}, where an answer is the same
+# as in interactive mode, or None while the type is unresolved
+answers = dict()
+# procs skipped in batch mode, as {unknown type: [procs]}, where a proc is
+# listed for each of its unknown types
+unresolved = collections.defaultdict(list)
+number_skipped_procs = 0
+if args.answers and path.exists(args.answers):
+    with open(args.answers, "r") as f:
+        answers = {k: v["answer"] for k, v in json.load(f).items()}
+
+# write the answers, along with the procs skipped because of unknown types
+def dump_answers():
+    for from_type in unresolved:
+        answers.setdefault(from_type, None)
+    content = {k: {"answer": v, "procs": unresolved.get(k, [])} for k, v in answers.items()}
+    tmp_path = f"{args.answers}.{getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, indent=2, sort_keys=True)
+    replace(tmp_path, args.answers)
+
+# force the use of a variable, otherwise bad inference from Nim
+FORCE_VARIABLE = re.compile(r'(?:u?int|float)[0-9]+|cstring')
+
+# variables shared by all procs in scoped mode, as {(type, value): name}
+hoisted_variables = dict()
+
+# return the name of a variable shared in scoped mode, made of its type and
+# value, so that the blocks using it don't depend on the procs generated
+# before them (see block_key)
+# eg. ("int8", "1") gives l_int8_1, and ("cstring", '"a"') gives l_cstring_<digest>
+def hoisted_name(declaration_type, value):
+    parts = [str(declaration_type)]
+    parts += [value] if re.fullmatch(r"[0-9A-Za-z.]+", value) else [md5(value.encode()).hexdigest()[:8]]
+    return "l_" + "_".join(k for part in parts for k in re.split(r"[^0-9A-Za-z]+", part) if k)
+
+# return the line declaring a variable, whose type is inferred by Nim
+# when declaration_type is not a string
+def declaration_line(keyword, var_name, declaration_type, value):
+    declaration_type_str = ""
+    # TODO really ugly
+    if type(declaration_type) is str:
+        declaration_type_str = f" : {declaration_type}"
+    return f"{keyword} {var_name}{declaration_type_str} = {value}"
 
 # Return the value to give to the param based on its type.
 # May return either a raw value (eg. 3, true) or a variable defined
@@ -340,36 +852,20 @@ def declare_var(from_type, dict_vars, context):
 #    eg. context = ["redirect_to": {'T': float64}, "ref": ["Response"]]
 # NOTE that dict_vars will be modified via board effects
 def get_param_value(from_type, dict_vars, context):
+    global impure_declarations
     context["history"].append(from_type)
-    if "|" in from_type:
-        # we take the 1st possibility
-        from_type = re.split(r"\s*\|\s*(?![^()\[\]{}]*(?:\)|\]|\}))", from_type)[0]
+    modifiers, from_type = parse_modifiers(from_type)
 
     # used to modify what needs to be returned
     RETURNER = lambda x: x
-    USE_VARIABLE = False
-    if from_type.startswith("var "):
-        USE_VARIABLE = True
-        from_type = from_type[4:]  # remove the "var " prefix
+    USE_VARIABLE = "var" in modifiers
 
-    if from_type.startswith("not "):
-        # we use bool by default except when the type is "not bool"
-        if from_type == "not bool":
-            from_type = "int"
-        else:
-            from_type = "bool"
-
-    if from_type.startswith("distinct "):
+    if "distinct" in modifiers:
         USE_VARIABLE = True
-        from_type = from_type[9:]
         cast_type = context["history"][-2]  # the type defined as "distinct thing"
         RETURNER = lambda x: f"{cast_type}({x})"  # cast the value
 
-    if from_type.startswith("owned "):
-        # don't care?
-        from_type = from_type[6:]
-
-    if from_type.startswith("ptr "):
+    if "ptr" in modifiers:
         # This is quite tricky as we need to instanciate
         # a variable of the given type (eg. ptr Socket)
         # and then pass as value "addr(variable_create)".
@@ -377,10 +873,11 @@ def get_param_value(from_type, dict_vars, context):
         # is refered by another.
         #   eg. AsyncEvent = ptr AsyncEventImpl
         #       but AsyncEventImpl is not exported!
+        impure_declarations += 1
         if len(context["history"]) > 1:
             cast_to = context["history"][-2]
         else:
-            cast_to = from_type
+            cast_to = f"ptr {from_type}"
 
         # USE_VARIABLE = True
         # from_type = from_type[9:]
@@ -389,19 +886,27 @@ def get_param_value(from_type, dict_vars, context):
         # new trick 0:)
         return f"cast[{cast_to}](0)"
 
-    if re.match(r'(?:u?int|float)[0-9]+|cstring', from_type):
-        # force the use of a variable, otherwise bad inference from Nim
+    # in scoped mode, a variable which is not modified by the proc is
+    # declared once for all procs
+    HOIST = False
+    if FORCE_VARIABLE.match(from_type):
+        HOIST = args.scoped and not USE_VARIABLE
         USE_VARIABLE = True
 
     declaration_type, value = declare_var(from_type, dict_vars, context)
 
-    if USE_VARIABLE:
+    if HOIST:
+        value = hoisted_variables.setdefault((declaration_type, value), hoisted_name(declaration_type, value))
+    elif USE_VARIABLE:
+        impure_declarations += 1
         # if we saw the type before, use the already defined variable
         if from_type in dict_vars:
             var_name = dict_vars[from_type][0]
-        # if we haven't seen the type before, create a variable
+        # if we haven't seen the type before, create a variable, named after
+        # the proc and the order of the arguments (see "prefix"), or only
+        # unique in its scope in scoped mode
         else:
-            var_name = "v_" + uuid.uuid4().hex
+            var_name = f"v{len(dict_vars)}" if args.scoped else f"{context['prefix']}_{len(dict_vars)}"
             dict_vars[from_type] = (var_name, declaration_type, value)
 
         # we want to return the variable
@@ -409,160 +914,408 @@ def get_param_value(from_type, dict_vars, context):
 
     return RETURNER(value)
 
-number_total_procs = 0
-for nimlib in args.libs:
-    # some libs can't be imported because they are already
-    # included (eg. system.nim)
-    IMPORT_LIB = False
-    if nimlib.startswith("pure/"):
-        IMPORT_LIB = True
-
-    libname = nimlib.split("/")[-1]
-    nimlib = path.join(NIMPATH, "lib", nimlib)
-
-    print(f"# Exporting library {libname} ({nimlib})")
-    p = subprocess.Popen([nimbin, "jsondoc", "-o:/tmp/nimdoc.json", nimlib], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    while p.poll() is None:
-        time.sleep(1)
-
-    with open("/tmp/nimdoc.json", "r") as f:
-        j = json.load(f)
+# entries of the documentation read, by kind
+READ_TYPES = ("skType",)
+# Read only proc and func
+READ_PROC = ("skProc", "skFunc")
+
+# find type definition s.a.
+# Proxy = ref object
+#   url*: Uri
+#   auth*: string
+# TODO handle named tuples as in
+# https://nim-lang.org/docs/tut1.html#advanced-types-tuples
+# re.DOTALL for multilines matching
+TYPE_PATTERN = re.compile(r"^(?P<name>[^=]*?) *= *(?P<definition>.+)$", re.DOTALL)
+# the declarations of procs may span on many lines
+DECLARATION_BREAK = re.compile(r"\n *")
+
+# classify a type declared in a lib documentation, as (type name, kind,
+# value, alias) where kind is one of "ref", "enum", "object" or "redirect",
+# value is the value of enums or the type redirected to, and alias is the
+# definition of types without generics, or return None if the type can't
+# be parsed
+# NB: this must not depend on meta_context, as it is cached per lib
+def parse_type(type_raw):
+    type_matched = TYPE_PATTERN.match(type_raw['code'])
+    type_name = type_raw["name"]
+    if not type_matched:
+        # TODO should print a warning
+        return None
+    pre_parsed = type_matched.groupdict()
+    type_declared_name = pre_parsed["name"]
+    type_definition = pre_parsed["definition"]
+    HAS_GENERICS = type_name != type_declared_name
+    # used to know whether the type refers to a ref type
+    alias = None if HAS_GENERICS else type_definition.split("[")[0]
+    if type_definition.startswith("ref object"):
+        # match_generics = r"^" + type_name + "\[(.+)\]$"
+        # res = re.search(match_generics, type_declared_name)
+        # if res:
+        #     generic_raw = res.group(1)
+        #     gereric_parsed = parse_args(generic_raw)
+        #     for parsed in gereric_parsed:
+        #         e_name, e_type, _ = parsed
+        #         print(parsed)
+        #         if not e_type:  # eg. proc test[T] will give us [T, None, None]
+        #             parsed[1] = 'int'
+        #
+        #     # replace "my_type[T]" by "my_type[int]"
+        #     li_types_generics = [e[1] for e in gereric_parsed]
+        #     type_name_expanded = "{}[{}]".format(type_name, ", ".join(li_types_generics))
+        #
+        #     meta_context["redirect_to"][type_name] = e_type
+
+        return (type_name, "ref", None, alias)
+
+    elif type_definition.startswith("enum"):
+        match_first_enum = r"^enum *([^,]+)"
+        log(type_definition, type_definition.replace("\n", ""))
+        first_of_enum = re.search(match_first_enum, type_definition.replace("\n", "")).group(1)
+        return (type_name, "enum", f"{type_name}.{first_of_enum}", alias)
+
+    elif type_definition.startswith("object"):
+        return (type_name, "object", None, alias)
+
+    # TODO handle objects
+    else:
+        if HAS_GENERICS:
+            # TODO this is only a dirty workaroud for [T] generics, most common
+            if type_declared_name == type_name + "[T]":
+                type_definition = type_definition.replace("[T]", "[{T}]")
+        return (type_name, "redirect", type_definition, alias)
+
+# classify the types declared in a lib documentation, see parse_type()
+def parse_types(entries):
+    return [t for t in (parse_type(k) for k in entries if k['type'] in READ_TYPES) if t]
+
+# parse a proc declared in a lib documentation, as (declaration parsed,
+# generics parsed, arguments parsed)
+def parse_proc(entry):
+    # fusion possible multiple lines on one
+    proc_declaration_raw = DECLARATION_BREAK.sub("", entry['code'])
+    proc_declaration_parsed = parse_proc_declaration(proc_declaration_raw)
+    if not proc_declaration_parsed["matched"]:
+        print(f"WARNING: could not parse {proc_declaration_raw} ({proc_declaration_parsed.get('error', 'unknown declaration')})")
+        exit(1)
 
-    print(f"# Parsing types")
-    # find type definition s.a.
-    # Proxy = ref object
-    #   url*: Uri
-    #   auth*: string
-    READ_TYPES = ("skType")
-    # TODO handle named tuples as in
-    # https://nim-lang.org/docs/tut1.html#advanced-types-tuples
-    PATTERN = r"^(?P<name>[^=]*?) *= *(?P<definition>.+)$"
-    gen = iter(k for k in j["entries"] if k['type'] in READ_TYPES)
-    # re.DOTALL for multilines matching
-    codes = map(lambda x: (x,re.match(PATTERN, x['code'], re.DOTALL)), gen)
-    for c in codes:
-        type_raw, type_matched = c
-        type_name = type_raw["name"]
-        if not type_matched:
-            # TODO should print a warning
+    generic_raw = proc_declaration_parsed['generics']
+    args_raw = proc_declaration_parsed['arguments']
+    generics_parsed = parse_args(generic_raw) if generic_raw else None
+    args_parsed = list()
+    if args_raw:  # there could be no arg at all
+        args_parsed = parse_args(args_raw)
+    return (proc_declaration_parsed, generics_parsed, args_parsed)
+
+# parse the procs declared in a lib documentation, see parse_proc()
+def parse_procs(entries):
+    return [parse_proc(k) for k in entries if k['type'] in READ_PROC]
+
+# read the entries of a JSON documentation one at a time, along with the
+# file, instead of loading the whole documentation (eg. of system.nim),
+# whose other values are skipped
+def stream_entries(jsondoc_path, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    separators = re.compile(r"[\s,:]*")
+    # what may follow the part of a number already read, eg. "1." or "1e"
+    number_tail = re.compile(r"[0-9.eE+-]*")
+    with open(jsondoc_path, "r") as f:
+        buffer, start = "", 0
+
+        # read more of the file, at least as much as what is buffered, so
+        # that a large value is not decoded too many times
+        # return whether anything was read
+        def read():
+            nonlocal buffer, start
+            chunk = f.read(max(chunk_size, len(buffer) - start))
+            buffer, start = buffer[start:] + chunk, 0
+            return bool(chunk)
+
+        # skip the separators, and return the next character, or None at
+        # the end of the file
+        def peek():
+            nonlocal start
+            while True:
+                start = separators.match(buffer, start).end()
+                if start < len(buffer):
+                    return buffer[start]
+                if not read():
+                    return None
+
+        # decode the next value
+        # NB: a value ending the buffer, eg. a number, may be truncated, and
+        # a number cut after its "." or "e" is decoded without them
+        def decode():
+            nonlocal start
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, start)
+                    number = type(value) in (int, float)
+                    if not (end == len(buffer) or number and number_tail.fullmatch(buffer, end)) or not read():
+                        start = end
+                        return value
+                except json.JSONDecodeError:
+                    if not read():
+                        raise
+
+        if peek() != "{":
+            raise ValueError(f"{jsondoc_path} is not a JSON documentation")
+        start += 1
+        while peek() not in ("}", None):
+            key = decode()
+            if key == "entries" and peek() == "[":
+                start += 1
+                while peek() not in ("]", None):
+                    yield decode()
+                start += 1
+            else:
+                decode()
+
+# return the path of the cached documentation and parsing of a lib, keyed
+# by the version of the Nim extracting the documentation, the files of the
+# lib and the code of NimP, or None if the lib source cannot be found or its
+# documentation is given
+def parse_cache_path(nimlib):
+    if args.docs or docs_nim_version is None or not path.exists(lib_source(nimlib)):
+        return None
+    lib_hash = md5()
+    for file_path in lib_files(nimlib):
+        with open(file_path, 'rb') as f:
+            lib_hash.update(f.read() + b"\0")
+    key = md5(f"{docs_nim_version}\0{lib_hash.hexdigest()}\0{NIMP_DIGEST}".encode()).hexdigest()
+    return path.join(PARSE_CACHE_PATH, f"{key}.pickle")
+
+# extract the JSON documentation of a lib into its own file
+# return the path of the file, or None if the extraction failed
+def jsondoc(nimlib):
+    name = nimlib.replace("/", "_")
+    if args.docs:
+        output = path.join(args.docs, f"{name}.json")
+        return output if path.exists(output) else None
+    output = path.join(WORKSPACE, f"nimdoc_{name}.json")
+    nimcache = path.join(WORKSPACE, f"nimcache_doc_{name}")
+    with stage("jsondoc", nimlib):
+        p = subprocess.Popen([nimbin, "jsondoc", f"-o:{output}", f"--nimcache:{nimcache}", path.join(NIMPATH, "lib", nimlib)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        p.wait()
+    return output if p.returncode == 0 else None
+
+# a multiline comment which doesn't nest another one, eg. "#[ ... ]#" or "##[ ... ]##"
+MULTILINE_COMMENT = re.compile(r"#\[(?:(?!#\[|\]#).)*\]#", re.DOTALL)
+# eg. 'runnableExamples("-d:ssl"):'
+RUNNABLE_EXAMPLES = re.compile(r"^([ \t]*)runnableExamples\b")
+
+# the modules imported or included by a Nim file, as found in its source,
+# as (keyword, module path)
+# eg. "import std/[os, strutils], net" gives ("import", "std/os"),
+# ("import", "std/strutils") and ("import", "net"), and "from times import
+# Time" gives ("from", "times")
+# the statements of comments and of examples don't count, as they are not
+# part of the module
+def source_statements(file_path):
+    if not path.exists(file_path):
+        return list()
+    with open(file_path, "r", errors="replace") as f:
+        source = f.read()
+    statements = list()
+    # nested comments are removed from the innermost one
+    count = 1
+    while count:
+        source, count = MULTILINE_COMMENT.subn("", source)
+    source = re.sub(r"#[^\n]*", "", source)
+    # examples span on the following lines indented more
+    lines, examples_indent = list(), None
+    for line in source.split("\n"):
+        if examples_indent is not None and (not line.strip() or len(line) - len(line.lstrip()) > examples_indent):
             continue
-        pre_parsed = type_matched.groupdict()
-        type_declared_name = pre_parsed["name"]
-        type_definition = pre_parsed["definition"]
-        HAS_GENERICS = type_name != type_declared_name
-        if type_definition.startswith("ref object"):
-            # match_generics = r"^" + type_name + "\[(.+)\]$"
-            # res = re.search(match_generics, type_declared_name)
-            # if res:
-            #     generic_raw = res.group(1)
-            #     gereric_parsed = parse_args(generic_raw)
-            #     for parsed in gereric_parsed:
-            #         e_name, e_type, _ = parsed
-            #         print(parsed)
-            #         if not e_type:  # eg. proc test[T] will give us [T, None, None]
-            #             parsed[1] = 'int'
-            #
-            #     # replace "my_type[T]" by "my_type[int]"
-            #     li_types_generics = [e[1] for e in gereric_parsed]
-            #     type_name_expanded = "{}[{}]".format(type_name, ", ".join(li_types_generics))
-            #
-            #     meta_context["redirect_to"][type_name] = e_type
-
-            meta_context["ref"].append(type_name)
-
-        # TODO really ugly
-        elif not HAS_GENERICS and type_definition.split("[")[0] in meta_context["ref"]:
-            meta_context["ref"].append(type_name)
-
-
-        elif type_definition.startswith("enum"):
-            match_first_enum = r"^enum *([^,]+)"
-            print(type_definition, type_definition.replace("\n", ""))
-            first_of_enum = re.search(match_first_enum, type_definition.replace("\n", "")).group(1)
-            meta_context["give_value"][type_name] = f"{type_name}.{first_of_enum}"
-
-        elif type_definition.startswith("object"):
-            meta_context["objects"].append(type_name)
-
-        # TODO handle objects
-        else:
-            if HAS_GENERICS:
-                # TODO this is only a dirty workaroud for [T] generics, most common
-                if type_declared_name == type_name + "[T]":
-                    type_definition = type_definition.replace("[T]", "[{T}]")
-            meta_context["redirect_to"][type_name] = type_definition
-
-    #print(meta_context)
-
-    print(f"# Producing code")
-
-    # Read only proc and func
-    READ_PROC = ("skProc", "skFunc")
-    # iter and fusion possible multiple lines on one
-    PATTERN = r"^(?:proc|func) (?P<name>.*?)\*?(?:\[(?P<generic>.*)\])?\((?P<args>.*?)\)(?:: (?P<return_type>[^{}]+))?(?: *{\. *(.*?) *\.})?$"
-    gen = iter(re.sub(r"\n *", "", j["entries"][k]['code']) for k in range(len(j["entries"])) if j["entries"][k]['type'] in READ_PROC)
-    #codes = map(lambda x: (x,re.match(PATTERN, x)), gen)
-
-    if IMPORT_LIB:
-        procs_calls_code += f"import {libname}\n"
-
-    for proc_declaration_raw in gen:
-        proc_declaration_parsed = parse_proc_declaration(proc_declaration_raw)
-        if not proc_declaration_parsed["matched"]:
-            print(f"WARNING: could not parse {proc_declaration_raw}")
-            exit(1)
-
-        #pre_parsed = declaration_matched.groupdict()
-        print(proc_declaration_parsed)
-        proc_name = proc_declaration_parsed['name']
-        args_raw = proc_declaration_parsed['arguments']
-        generic_raw = proc_declaration_parsed['generics']
-
-        variables_declaration_code = ""
-        variables_declaration_mapping = dict()
-        context = copy.deepcopy(meta_context)
-
-        # parse the generic first, if any
-        if generic_raw:
-            gereric_parsed = parse_args(generic_raw)
-            print(gereric_parsed)
-            for parsed in gereric_parsed:
-                e_name, e_type, _ = parsed
-                if not e_type:  # eg. proc test[T] will give us [T, None, None]
-                    e_type = 'int'
-                context["redirect_to"][e_name] = e_type
-
-        args_parsed = []
-        if args_raw:  # there could be no arg at all
-            args_parsed = parse_args(args_raw)
-
-        return_type = proc_declaration_parsed["return_type"]
-        if return_type:
-            return_type = return_type.strip()
-
-        parsed = {
-            'name': proc_name,
-            'args': args_parsed,
-            'return_type': return_type
-        }
-
-        print(parsed)
-        print("context:", context)
-
+        r = RUNNABLE_EXAMPLES.match(line)
+        examples_indent = len(r.group(1)) if r else None
+        if r is None:
+            lines.append(line)
+    source = "\n".join(lines)
+    # statements may span on the following lines, after a comma
+    for r in re.finditer(r"^[ \t]*(import|include|from)[ \t]+((?:[^\n]*,[ \t]*\n)*[^\n]*)", source, re.MULTILINE):
+        statement = re.sub(r"\s+(?:import|except)\s.*", "", r.group(2).replace("\n", " "), flags=re.DOTALL)
+        statement = re.sub(r"([\w/]*/)\[(.*?)\]", lambda m: ", ".join(m.group(1) + k.strip() for k in m.group(2).split(",")), statement)
+        for module in statement.split(","):
+            module = re.sub(r"\s+as\s+\w+$", "", module.strip()).strip("\"")
+            if module:
+                statements.append((r.group(1), module))
+    return statements
+
+# return the path of the source of a lib
+def lib_source(nimlib):
+    lib_path = path.join(NIMPATH, "lib", nimlib)
+    return lib_path if lib_path.endswith(".nim") else lib_path + ".nim"
+
+# the modules imported by a lib
+# NB: the JSON documentation does not give them
+def lib_imports(nimlib):
+    return {module.split("/")[-1] for _, module in source_statements(lib_source(nimlib))}
+
+# the files making a lib: its source, and the files it includes, eg. the
+# many files of system
+def lib_files(nimlib):
+    files = [lib_source(nimlib)]
+    for file_path in files:
+        for keyword, module in source_statements(file_path):
+            included = path.normpath(path.join(path.dirname(file_path), module + ".nim"))
+            if keyword == "include" and path.exists(included) and included not in files:
+                files.append(included)
+    return files
+
+# order the libs so that each one comes after the libs it imports, as type
+# declarations are kept for the next ones, and otherwise in the given order
+def dependency_order(libs):
+    names = {nimlib.split("/")[-1]: nimlib for nimlib in libs}
+    dependencies = {nimlib: {names[k] for k in lib_imports(nimlib) if k in names} - {nimlib} for nimlib in libs}
+    ordered = list()
+    while len(ordered) < len(libs):
+        ready = [k for k in libs if k not in ordered and dependencies[k] <= set(ordered)]
+        # NB: on a cycle, the first lib given goes first
+        ordered.append(ready[0] if ready else next(k for k in libs if k not in ordered))
+    return ordered
+
+# a lib given twice is only generated once
+given_libs = list(dict.fromkeys(args.libs))
+libs = dependency_order(given_libs)
+if libs != given_libs:
+    print("# Libraries reordered after their imports: " + ", ".join(libs))
+
+# load and parse the documentation of a lib
+# return the parsed lib, and the time spent in each stage when done in a
+# worker process, to be accounted by the main one
+def parse_lib(nimlib, jsondoc_path, worker=False):
+    if worker:
+        stage_metrics.clear()
+        breakdown_metrics.clear()
+    parsed_lib = {'types': list(), 'procs': list()}
+    if args.whole_docs:
+        with stage("load", nimlib), open(jsondoc_path, "r") as f:
+            j = json.load(f)
+        with stage("parse_types", nimlib):
+            parsed_lib['types'] = parse_types(j["entries"])
+        with stage("parse_procs", nimlib):
+            parsed_lib['procs'] = parse_procs(j["entries"])
+    else:
+        # a single pass, as reading and parsing the entries are interleaved
+        with stage("parse", nimlib):
+            for entry in stream_entries(jsondoc_path, args.read_size):
+                if entry['type'] in READ_TYPES:
+                    parsed = parse_type(entry)
+                    if parsed:
+                        parsed_lib['types'].append(parsed)
+                elif entry['type'] in READ_PROC:
+                    parsed_lib['procs'].append(parse_proc(entry))
+    return parsed_lib, (stage_metrics, breakdown_metrics) if worker else None
+
+# extract the documentation of a lib, and parse it in a worker process, as
+# parsing is CPU bound
+# return the parsed lib, or None if the extraction failed
+def extract_lib(nimlib, cache_path):
+    jsondoc_path = jsondoc(nimlib)
+    if not jsondoc_path:
+        return None
+    if parse_executor is None:
+        parsed_lib, _ = parse_lib(nimlib, jsondoc_path)
+    else:
+        parsed_lib, (stages, breakdown) = parse_executor.submit(parse_lib, nimlib, jsondoc_path, True).result()
+        with metrics_lock:
+            for m, other in [(stage_metrics, stages)] + [(breakdown_metrics[k], v) for k, v in breakdown.items()]:
+                for name, entry in other.items():
+                    total = m.setdefault(name, {"wall": 0.0, "cpu": 0.0, "count": 0})
+                    for k in total:
+                        total[k] += entry[k]
+    if cache_path:
+        makedirs(PARSE_CACHE_PATH, exist_ok=True)
+        dump_cache(parsed_lib, cache_path)
+    return parsed_lib
+
+parse_cache_paths = [parse_cache_path(nimlib) for nimlib in libs]
+
+# the workers are forked before any thread is started, which makes forking
+# safe, and they don't use the store
+parse_executor = None
+if args.jobs > 1 and len(libs) > 1:
+    parse_executor = concurrent.futures.ProcessPoolExecutor(args.jobs, mp_context=multiprocessing.get_context("fork"))
+    parse_executor.submit(int).result()
+
+# the documentation of all libs is extracted and parsed in parallel, but
+# consumed in the order of the libs, as type declarations are kept for the
+# next ones
+# NB: libs found in the parse cache don't need any extraction
+jsondoc_executor = concurrent.futures.ThreadPoolExecutor(args.jobs)
+parsed_libs = [
+    None if cache_path and path.exists(cache_path) else jsondoc_executor.submit(extract_lib, nimlib, cache_path)
+    for nimlib, cache_path in zip(libs, parse_cache_paths)
+]
+
+# produce the block of code calling a proc of a lib: the declarations of
+# the variables followed by the call
+# return the block, and the modules it imports
+# raise UnresolvedType with the types of the arguments which can't be resolved
+def generate_block(nimlib, proc_index, proc_declaration_parsed, generics_parsed, arguments_parsed):
+    #pre_parsed = declaration_matched.groupdict()
+    log(proc_declaration_parsed)
+    libname = nimlib.split("/")[-1]
+    proc_name = proc_declaration_parsed['name']
+
+    variables_declaration_lines = list()
+    variables_declaration_mapping = dict()
+    context = layer_context(meta_context)
+    # the variables of the proc are named after it, so that the same
+    # libs always give the same code
+    context["prefix"] = f"v_{libname}_{proc_index}"
+    context["used"] = list()
+
+    # parse the generic first, if any
+    if generics_parsed:
+        log(generics_parsed)
+        for parsed in generics_parsed:
+            e_name, e_type, _ = parsed
+            if not e_type:  # eg. proc test[T] will give us [T, None, None]
+                e_type = 'int'
+            context["redirect_to"][e_name] = e_type
+
+    # copied, as the values of the arguments are filled in below
+    args_parsed = [list(arg) for arg in arguments_parsed]
+
+    return_type = proc_declaration_parsed["return_type"]
+    if return_type:
+        return_type = return_type.strip()
+
+    parsed = {
+        'name': proc_name,
+        'args': args_parsed,
+        'return_type': return_type
+    }
+
+    log(parsed)
+    log("context:", context, level=2)
+
+    with stage("resolve", nimlib):
+        # the other arguments are resolved all the same, to find every
+        # unknown type of the proc at once in batch mode
+        unknown_types = list()
         for arg in args_parsed:
             arg_name, arg_type, arg_value = arg
             # if we have a default value, just KISS
             if not arg_value:
                 context["history"] = list()
-                arg[2] = get_param_value(arg_type, variables_declaration_mapping, context)
+                try:
+                    arg[2] = get_param_value(arg_type, variables_declaration_mapping, context)
+                except UnresolvedType as e:
+                    unknown_types += [k for k in e.args if k not in unknown_types]
             else:
                 # we don't care, let the default param
                 arg[2] = None
+        if unknown_types:
+            raise UnresolvedType(*unknown_types)
 
+    with stage("emit", nimlib):
         #print(parsed)
         args_call_str = ", ".join(k[2] for k in args_parsed if k[2] is not None)
         discard_str = "discard " if return_type else ""
-        number_total_procs += 1
         proc_call_str = f"{discard_str}{libname}.{proc_name}({args_call_str})"
 
         if proc_call_str.count("(") != proc_call_str.count(")"):
@@ -574,72 +1327,739 @@ for nimlib in args.libs:
         # generate variables
         for var_type in variables_declaration_mapping:
             var_name, declaration_type, value = variables_declaration_mapping[var_type]
-            declaration_type_str = ""
-            # TODO really ugly
-            if type(declaration_type) is str:
-                declaration_type_str = f" : {declaration_type}"
-
-            variables_declaration_code += f"var {var_name}{declaration_type_str} = {value}" + "\n"
+            variables_declaration_lines.append(declaration_line("var", var_name, declaration_type, value))
+
+        lines = variables_declaration_lines + [proc_call_str]
+        if args.scoped:
+            # each call in its own scope, which can't be empty
+            if proc_call_str.startswith("#"):
+                lines.append("discard")
+            lines = ["block:"] + ["  " + line for line in lines]
+    block = "\n".join(lines)
+    log(block)
+
+    # the block imports its lib, and the libs declaring the types it uses,
+    # or the fixed imports when one of them is not declared by a known lib
+    # NB: the generics of the proc and the redirections to other types,
+    # whose names don't appear in the code, don't need any import
+    modules = [lib_module(nimlib)]
+    needs_fixed_imports = args.fixed_imports
+    for type_name in context["used"]:
+        if type_name in context["redirect_to"].maps[0]:
+            continue
+        elif type_name in type_owners:
+            modules.append(lib_module(type_owners[type_name]))
+        elif not meta_context["redirect_to"].get(type_name, "distinct").startswith("distinct"):
+            continue
+        else:
+            needs_fixed_imports = True
+    if needs_fixed_imports:
+        modules = list(FIXED_IMPORTS) + modules
+    return block, tuple(dict.fromkeys(filter(None, modules)))
 
-        procs_calls_code += variables_declaration_code + proc_call_str + "\n\n"
-        #print(proc_call_str)
-    with open(CACHE_PATH, 'wb') as f:
-        f.write(pickle.dumps(meta_context))
+number_total_procs = 0
+for nimlib, parsed_lib, cache_path in zip(libs, parsed_libs, parse_cache_paths):
+    libname = nimlib.split("/")[-1]
+    lib_path = path.join(NIMPATH, "lib", nimlib)
 
+    print(f"# Exporting library {libname} ({lib_path})")
+    if parsed_lib is None:
+        print(f"# Loading parsed library from cache")
+        with stage("load", nimlib), open(cache_path, 'rb') as f:
+            parsed_lib = pickle.load(f)
+    else:
+        print(f"# Parsing library")
+        parsed_lib = parsed_lib.result()
+        if parsed_lib is None:
+            print(f"WARNING: could not extract the documentation of {lib_path}")
+            continue
 
+    print(f"# Parsing types")
+    for type_name, kind, value, alias in parsed_lib['types']:
+        if kind == "ref":
+            learn("ref", type_name, lib=nimlib)
 
-print(procs_calls_code)
+        # TODO really ugly
+        elif alias is not None and (alias in meta_context["ref"] or recall(alias) and alias in meta_context["ref"]):
+            learn("ref", type_name, lib=nimlib)
 
-all_code = f"""
-{meta_variables}
-{procs_calls_code}
-"""
-number_procs_compiled = number_total_procs
+        elif kind == "enum":
+            learn("give_value", type_name, value, nimlib)
 
-if args.only_compile:
-    with open(CODE_PATH, "r") as f:
-        all_code = f.read()
+        elif kind == "object":
+            learn("objects", type_name, lib=nimlib)
 
-def compile():
-    with open(CODE_PATH, "w") as f:
-        f.write(all_code)
+        else:
+            learn("redirect_to", type_name, value, nimlib)
+    context_generation += 1
 
-    print(f"# Compiling code")
-    with open("/tmp/buffer", 'w') as f:
-        p = subprocess.Popen([nimbin, "c", "-o:/tmp/dummy_nim",
-            #"--cpu:i386",
-            #"--os:windows", "--gcc.exe:i686-w64-mingw32-gcc", "--gcc.linkerexe:i686-w64-mingw32-gcc",
-            "-d:nimCoroutines", "-d:release", "-d:ssl", CODE_PATH], stdout=f, stderr=f)
+    #print(meta_context)
 
-    while p.poll() is None:
-        time.sleep(0.1)
+    print(f"# Producing code")
 
-    if p.returncode == 0:
-        print(f"Successfully compiled {number_procs_compiled}/{number_total_procs} procs")
-        return 0
+    for proc_index, (proc_declaration_parsed, generics_parsed, arguments_parsed) in enumerate(parsed_lib['procs']):
+        try:
+            block, imports = generate_block(nimlib, proc_index, proc_declaration_parsed, generics_parsed, arguments_parsed)
+        except UnresolvedType as e:
+            proc_name = proc_declaration_parsed['name']
+            print(f"WARNING: skipping {libname}.{proc_name}, unknown types {', '.join(e.args)}")
+            for unknown_type in e.args:
+                unresolved[unknown_type].append(f"{libname}.{proc_name}")
+            number_skipped_procs += 1
+            continue
+        number_total_procs += 1
+        blocks.append(block)
+        block_imports.append(imports)
+        sources.append((nimlib, proc_index, proc_declaration_parsed, generics_parsed, arguments_parsed))
+    save_context()
+jsondoc_executor.shutdown()
+if parse_executor is not None:
+    parse_executor.shutdown()
+header_lines += [declaration_line("let", var_name, declaration_type, value)
+                 for (declaration_type, value), var_name in hoisted_variables.items()]
+if args.libs:
+    print("# Registries: " + ", ".join(f"{k} {len(v)} types ({registry_lookups[k]} lookups)" for k, v in meta_context.items()) + f", {recalled_types} types recalled from the cache")
+    if args.answers:
+        dump_answers()
+if blocks:
+    imported = set(itertools.chain.from_iterable(block_imports))
+    print(f"# {len(imported)} modules imported, instead of {len(set(FIXED_IMPORTS) | set(filter(None, map(lib_module, libs))))} with the fixed imports")
+if unresolved:
+    print(f"# {number_skipped_procs} procs skipped because of {len(unresolved)} unknown types, see {args.answers}")
+
+# flags used both when checking and when building the code
+NIM_FLAGS = [
+    #"--cpu:i386",
+    #"--os:windows", "--gcc.exe:i686-w64-mingw32-gcc", "--gcc.linkerexe:i686-w64-mingw32-gcc",
+    "-d:nimCoroutines", "-d:release", "-d:ssl",
+]
+
+# flags combinations built in matrix mode, when none is given
+# eg. "--opt:size -d:useMalloc"
+MATRIX = [" ".join(filter(None, k)) for k in itertools.product(("--opt:none", "--opt:speed", "--opt:size"), ("", "-d:useMalloc"))]
+
+# split the code into a header (imports, types and shared variables), one block per proc
+# call (variables declarations followed by the call), and a trailer
+# holding the errors already commented out by a previous run
+def split_blocks(code):
+    header, blocks, trailer = list(), list(), list()
+    current = list()
+    lines = iter(code.split("\n"))
+    for line in lines:
+        if line.startswith("# ERROR traceback"):
+            trailer = [line] + list(lines)
+            break
+        if line.startswith(("import ", "type ", "let ")):
+            header.append(line)
+        elif line.strip():
+            current.append(line)
+        elif current:
+            blocks.append("\n".join(current))
+            current = list()
+    if current:
+        blocks.append("\n".join(current))
+    return "\n".join(header), blocks, "\n".join(trailer)
+
+# generated variables, named after their proc, or random in older code
+GENERATED_VARIABLE = re.compile(r"\bv_(?:[0-9a-f]{32}|\w+_[0-9]+_[0-9]+)\b")
+
+# return the key of a block in the verdicts cache, which depends on the
+# Nim version and flags: generated variables are renamed, so that the
+# same block always gives the same key, wherever it is
+def block_key(block, flags=NIM_FLAGS):
+    names = dict()
+    normalized = GENERATED_VARIABLE.sub(lambda m: names.setdefault(m.group(0), f"v_{len(names)}"), block)
+    return md5("\0".join([nim_version] + flags + [normalized]).encode()).hexdigest()
+
+# compilers run "nim <command> <options> <main_path>", writing their output
+# to the log file, and return the return code
+
+def nim_compiler(command, options, main_path, log):
+    p = subprocess.Popen([nimbin, command] + options + [main_path], stdout=log, stderr=log)
+    p.wait()
+    return p.returncode
+
+# a stand-in for Nim, to test and benchmark the repair without it: after
+# the given latency, it fails on the lines matching --fake-errors, with a
+# located error, and on the lines matching --fake-silent when building,
+# without any location, as the C compiler does
+# NB: commented out lines are ignored, and modules imported from the same
+# directory are compiled as well
+def fake_compiler(command, options, main_path, log):
+    time.sleep(args.fake_latency)
+    returncode = 0
+    modules, pending = list(), [main_path]
+    while pending:
+        module_path = pending.pop(0)
+        if module_path in modules:
+            continue
+        modules.append(module_path)
+        with open(module_path, "r") as f:
+            lines = f.read().split("\n")
+        for n, line in enumerate(lines, 1):
+            if line.startswith("import "):
+                for imported in line[len("import "):].split(","):
+                    imported_path = path.join(path.dirname(module_path), imported.strip() + ".nim")
+                    if path.exists(imported_path):
+                        pending.append(imported_path)
+            elif line.startswith("#"):
+                continue
+            elif args.fake_errors and re.search(args.fake_errors, line):
+                log.write(f"{module_path}({n}, 1) Error: fake error\n")
+                returncode = 1
+            elif command == "c" and args.fake_silent and re.search(args.fake_silent, line):
+                log.write("Error: execution of an external compiler program failed\n")
+                returncode = 1
+    return returncode
+
+COMPILERS = {
+    "nim": nim_compiler,
+    "fake": fake_compiler,
+}
 
-    return 1
+# duration of each compilation, as (repair name, command, seconds)
+compile_times = list()
+
+# type mismatches reported by Nim, which name the type expected
+# eg. "first type mismatch at position: 1\n  required type for a: openArray[string]"
+# eg. "/tmp/dummy_code.nim(12, 18) Error: type mismatch: got <int>"
+M_ERROR_LOCATION = re.compile(r"^(?:.*/)?([^/]+)\([0-9]+, [0-9]+\) ")
+# the candidates of an overloaded proc, each followed by its mismatch
+M_CANDIDATE = re.compile(r"^(?:proc|func) ", re.MULTILINE)
+M_MISMATCH_POSITION = re.compile(r"first type mismatch at position: ([0-9]+)\s+required type(?: for (\w+))?: (.+)")
+# eg. "type mismatch: got <int literal(1)> but expected 'TaintedString = string'"
+M_MISMATCH_EXPECTED = re.compile(r"type mismatch: got <.*?> but expected '(\w+) = (.+?)'")
+
+# number of times a block may be fixed, as a fix may fail in turn
+MAX_FIX_ATTEMPTS = 2
+fix_attempts = collections.Counter()
+fix_lock = threading.Lock()
+
+# return the name, generics and arguments (names and types) of a parsed
+# proc declaration, whatever their formatting, to tell which candidate
+# reported by Nim is the proc called
+def proc_signature(proc_declaration_parsed):
+    normalize = lambda k: re.sub(r"\s+", "", k or "")
+    arguments = parse_args(proc_declaration_parsed["arguments"]) if proc_declaration_parsed["arguments"] else ()
+    return (normalize(proc_declaration_parsed["name"]), normalize(proc_declaration_parsed["generics"]),
+            tuple((normalize(arg_name), normalize(arg_type)) for arg_name, arg_type, _ in arguments))
+
+# return the message of an error located in our code, along with the
+# mismatch reported for the proc of the given declaration, if any
+# errors located in the library (eg. inside a generic instantiated from our
+# code) are not ours to fix, and give None
+def located_mismatch(error, proc_declaration_parsed):
+    lines = error.split("\n")
+    ours = M_ERROR_LOCATION.match(lines[0])
+    k = next((k for k, line in enumerate(lines) if "Error:" in line), None)
+    if ours is None or k is None:
+        return None
+    located = M_ERROR_LOCATION.match(lines[k])
+    if located is None or located.group(1) != ours.group(1):
+        return None
+    message = "\n".join(lines[k:])
+    starts = [m.start() for m in M_CANDIDATE.finditer(message)]
+    signature = proc_signature(proc_declaration_parsed)
+    for start, end in zip(starts, starts[1:] + [len(message)]):
+        candidate = message[start:end]
+        declaration = parse_proc_declaration(candidate.split("\n")[0].strip())
+        if declaration["matched"] and proc_signature(declaration) == signature:
+            return lines[k], candidate
+    return lines[k], ""
+
+# fix the blocks failing because of a type mismatch, by generating them
+# again with the type expected by Nim for the offending arguments
+# only the mismatches located in our code are fixed, for the candidate
+# matching the proc called
+# the type expected is learnt in place of the type declared, when the
+# latter is a plain type name that no lib declares
+# return the fixed blocks, as {block index: block}
+def fix_mismatches(errors):
+    global context_generation
+    fixed = dict()
+    with fix_lock:
+        for i, error in errors.items():
+            if i >= len(sources) or fix_attempts[i] >= MAX_FIX_ATTEMPTS:
+                continue
+            nimlib, proc_index, proc_declaration_parsed, generics_parsed, arguments_parsed = sources[i]
+            # the arguments given in the call, by position
+            call_arguments = [j for j, arg in enumerate(arguments_parsed) if not arg[2]]
+            mismatch = located_mismatch(error, proc_declaration_parsed)
+            if mismatch is None:
+                continue
+            error_line, candidate = mismatch
+            expected = dict()
+            r = M_MISMATCH_POSITION.search(candidate)
+            if r:
+                position, arg_name, required = int(r.group(1)), r.group(2), r.group(3).strip()
+                if position <= len(call_arguments):
+                    j = call_arguments[position - 1]
+                    if arg_name is None or arg_name == arguments_parsed[j][0]:
+                        modifiers, _ = parse_modifiers(arguments_parsed[j][1])
+                        if "var" in modifiers and not required.startswith("var "):
+                            required = "var " + required
+                        expected[j] = required
+            for r in M_MISMATCH_EXPECTED.finditer(error_line):
+                for j in call_arguments:
+                    modifiers, base = parse_modifiers(arguments_parsed[j][1])
+                    if base == r.group(1):
+                        expected[j] = " ".join(modifiers + (r.group(2),))
+            if not expected:
+                continue
+
+            fix_attempts[i] += 1
+            fixed_arguments = [(arg_name, expected.get(j, arg_type), arg_value)
+                               for j, (arg_name, arg_type, arg_value) in enumerate(arguments_parsed)]
+            hoisted = set(hoisted_variables)
+            try:
+                block, imports = generate_block(nimlib, proc_index, proc_declaration_parsed, generics_parsed, fixed_arguments)
+            except UnresolvedType:
+                block = None
+            # the header is already written, new shared variables can't be used
+            new_hoisted = set(hoisted_variables) - hoisted
+            for k in new_hoisted:
+                hoisted_variables.pop(k)
+            # the declarations resolved meanwhile may use them (eg. @[l_int16_1]
+            # for seq[int16]), and must not be reused
+            if new_hoisted:
+                context_generation += 1
+            if block is None or new_hoisted or block == blocks[i]:
+                continue
+            fixed[i] = block
+            block_imports[i] = imports
+            sources[i] = (nimlib, proc_index, proc_declaration_parsed, generics_parsed, fixed_arguments)
+
+            generics = {k[0] for k in generics_parsed or ()}
+            for j, new_type in expected.items():
+                _, base = parse_modifiers(arguments_parsed[j][1])
+                _, new_base = parse_modifiers(new_type)
+                if not re.fullmatch(r"\w+", base) or base in generics or base in BUILTIN_VALUES or new_base == base:
+                    continue
+                # only aliases are redirected: types declared by a lib, and
+                # refs, objects and enums, are right, and the call is wrong
+                if base in type_owners or any(base in meta_context[k] for k in (*REGISTRIES, "give_value")):
+                    continue
+                print(f"# Learning {base} as {new_base}, from the errors of {nimlib}.{proc_declaration_parsed['name']}")
+                unlearn(base)
+                learn("redirect_to", base, new_base)
+                context_generation += 1
+        save_context()
+    return fixed
+
+# progress of each repair, as {repair name: state}, see repair()
+repair_states = dict()
+checkpoint_lock = threading.Lock()
+
+# write the code and the progress of its repair, so that an interrupted
+# run can be resumed (see --resume)
+# NB: the repairs of shards write it from their threads
+def save_checkpoint():
+    with checkpoint_lock:
+        dump_cache({
+            "header": header,
+            "trailer": trailer,
+            "blocks": blocks,
+            "block_imports": block_imports,
+            "sources": sources,
+            "verdicts": verdicts,
+            "repairs": repair_states,
+            "jobs": args.jobs,
+            "chunk_size": args.chunk_size,
+        }, CHECKPOINT_PATH)
+
+# compile and repair the given blocks of code until they compile:
+# failing blocks are commented out and moved at the end of the code
+# the code is compiled split into modules of chunk_size blocks, along
+# with a persistent nimcache, so that commenting out a block only
+# recompiles its module
+# verdicts, as {block key: (compiles, traceback)}, are used to comment out
+# blocks known to fail and to trust blocks known to compile, and are updated
+# fix, if given, is called with the errors found, and returns the blocks
+# fixed as {block index: block}, which are compiled again instead of being
+# commented out
+# imports, if given, are the modules imported by each block, otherwise the
+# imports are part of the header
+# the progress is checkpointed after each pass over the code, as the state
+# of the repair named name, and a repair found in repair_states resumes
+# from it
+# return the enabled blocks, the failed ones as {block index: traceback},
+# and the number of compilations for each command
+def repair(header, blocks, trailer="", enabled=None, failed=None, verdicts=None, flags=NIM_FLAGS,
+           code_path=CODE_PATH, log_path=path.join(WORKSPACE, "buffer"), commands=("check", "c"),
+           build_flags=(f"-o:{BINARY_PATH}", f"--nimcache:{path.join(WORKSPACE, 'nimcache')}"), name="",
+           chunk_size=args.chunk_size, fix=None, imports=None):
+    if enabled is None:
+        enabled = list(range(len(blocks)))
+    failed = dict(failed or {})
+    if verdicts is None:
+        verdicts = dict()
+    compilations = collections.Counter()
+
+    # commands already done
+    done = list()
+    state = repair_states.get(name)
+    if state is not None:
+        print(f"{name}Resuming the repair, {len(state['failed'])} procs already commented out")
+        enabled, failed, trusted = list(state["enabled"]), dict(state["failed"]), set(state["trusted"])
+        compilations.update(state["compilations"])
+        done = list(state["done"])
+    keys = {i: block_key(blocks[i], flags) for i in enabled}
+
+    if state is None:
+        known_to_fail = [i for i in enabled if verdicts.get(keys[i], (None,))[0] is False]
+        # the errors of a previous run may be enough to fix blocks
+        fixed = fix({i: verdicts[keys[i]][1] for i in known_to_fail}) if fix and known_to_fail else dict()
+        for i, block in fixed.items():
+            blocks[i] = block
+            keys[i] = block_key(block, flags)
+        known_to_fail = [i for i in enabled if verdicts.get(keys[i], (None,))[0] is False]
+        if fixed:
+            print(f"{name}{len(fixed)} procs known to fail were fixed")
+        if known_to_fail:
+            for i in known_to_fail:
+                failed[i] = verdicts[keys[i]][1]
+            enabled = [i for i in enabled if i not in failed]
+            print(f"{name}{len(known_to_fail)} procs known to fail were commented out")
+        trusted = {i for i in enabled if verdicts.get(keys[i], (None,))[0]}
+
+    # write the progress of the repair along with the code
+    def save_state():
+        with checkpoint_lock:
+            repair_states[name] = {
+                "enabled": list(enabled),
+                "failed": dict(failed),
+                "trusted": set(trusted),
+                "compilations": dict(compilations),
+                "done": list(done),
+            }
+        save_checkpoint()
+
+    # write a module made of the given header and blocks, block after block,
+    # followed by the failed blocks commented out if with_failed is True, in
+    # the order of the blocks, whether they failed or were known to fail
+    # return the first line of each block, to find the block owning a line
+    def write_module(file_path, module_header, indices, with_failed=False):
+        starts = list()
+        with open(file_path, "w") as f:
+            f.write("\n" + module_header + "\n\n")
+            line_number = module_header.count("\n") + 4
+            for i in indices:
+                starts.append(line_number)
+                f.write(blocks[i] + "\n\n")
+                line_number += blocks[i].count("\n") + 2
+            if with_failed:
+                for i, error in sorted(failed.items()):
+                    f.write("# ERROR traceback\n #" + error.replace("\n", "\n# ") + "\n")
+                    f.write("#" + blocks[i].replace("\n", "\n#") + "\n\n")
+                f.write(trailer)
+        return starts
+
+    # return the header of a module made of the given blocks, along with
+    # the modules they import
+    def module_header(indices):
+        if imports is None:
+            return header
+        return "\n".join(import_lines(k for i in indices for k in imports[i]) + [header])
+
+    # modules are named after the code, and written in the workspace
+    module = re.sub(r"\W", "_", path.splitext(path.basename(code_path))[0])
+    module_path = lambda suffix: path.join(WORKSPACE, f"{module}_{suffix}.nim")
+
+    # write the code made of the enabled blocks
+    # when split into chunks, the types and shared variables go to a module
+    # of their own, which never changes, and each chunk of blocks to its own
+    # module, which only changes when one of its blocks is commented out
+    # return the file to compile, and the blocks of each file along with
+    # their first lines, as {file: (starts, block indexes)}
+    def render(enabled):
+        if not chunk_size:
+            return code_path, {code_path: (write_module(code_path, module_header(enabled), enabled, with_failed=True), enabled)}
+        header_lines = header.split("\n")
+        types = [re.sub(r"^(type|let) (\w+)", r"\1 \2*", line) for line in header_lines if not line.startswith("import ")]
+        write_module(module_path("types"), "\n".join(types), [])
+        chunks = dict()
+        for i in enabled:
+            chunks.setdefault(i // chunk_size, list()).append(i)
+        locations = dict()
+        for k, indices in chunks.items():
+            chunk_path = module_path(f"chunk{k}")
+            chunk_header = [line for line in module_header(indices).split("\n") if line.startswith("import ")] + [f"import {module}_types"]
+            locations[chunk_path] = (write_module(chunk_path, "\n".join(chunk_header), indices), indices)
+        # the types are imported even without chunks, so that compiling no
+        # blocks still checks the header
+        main_path = module_path("main")
+        write_module(main_path, "\n".join([f"import {module}_types"] + [f"import {module}_chunk{k}" for k in chunks]), [])
+        return main_path, locations
+
+    # compile the enabled blocks with "nim <command>"
+    # return the return code, and the errors found as {block index: traceback}
+    def compile(enabled, command):
+        main_path, locations = render(enabled)
+        print(f"# {name}Compiling code ({command}, {len(enabled)} procs)")
+        compilations[command] += 1
+        options = ["--errorMax:0"] + flags
+        if command == "c":
+            options += build_flags
+        start = time.monotonic()
+        with stage(f"compile_{command}", name.strip(" []") or "main"), open(log_path, 'w') as f:
+            returncode = COMPILERS[args.backend](command, options, main_path, f)
+        compile_times.append((name, command, time.monotonic() - start))
+
+        errors = dict()
+        if returncode != 0:
+            with open(log_path, 'r') as f:
+                logs = f.read()
+            for file_path, line_number, error in traceback(logs, locations):
+                # the workspace differs between runs, unlike the code
+                error = WORKSPACE_PREFIX.sub("", error)
+                starts, indices = locations[file_path]
+                k = bisect_right(starts, line_number) - 1
+                # the line may be a blank one, after the block
+                if k >= 0 and line_number <= starts[k] + blocks[indices[k]].count("\n"):
+                    errors.setdefault(indices[k], error)
+        return returncode, errors
+
+    # find the failing blocks when the compiler does not report any location
+    # (eg. an error from the C compiler), by compiling halves of the suspected
+    # blocks, along with the trusted ones
+    # if failing is True, the blocks are already known not to compile
+    def bisect(suspects, trusted, command, failing=False):
+        if not failing:
+            returncode, errors = compile(sorted(trusted + suspects), command)
+            if returncode == 0:
+                return dict()
+            if errors:
+                return errors
+        if len(suspects) == 1:
+            return {suspects[0]: "no location reported by the compiler, found by bisection"}
+        half = len(suspects) // 2
+        errors = bisect(suspects[:half], trusted, command)
+        # if the first half compiles, the second one is the culprit
+        errors.update(bisect(suspects[half:], trusted, command, failing=not errors))
+        return errors
+
+    # check the code first, as it is cheaper and reports all semantic errors
+    # at once, then build it
+    for command in commands:
+        if command in done:
+            continue
+        # blocks known to compile don't need to be checked again
+        if command == "check" and all(i in trusted for i in enabled):
+            done.append(command)
+            continue
+        while True:
+            returncode, errors = compile(enabled, command)
+            if returncode == 0:
+                if command == "c":
+                    for i in enabled:
+                        verdicts[keys[i]] = (True, None)
+                break
+
+            print(f"{name}An error occurred, backtracing the logs")
+            if not errors:
+                if compile([], command)[0] != 0:
+                    print(f"{name}Cannot backtrace, exiting")
+                    exit(1)
+                print(f"{name}No location reported, bisecting the code")
+                suspects = [i for i in enabled if i not in trusted]
+                if suspects:
+                    errors = bisect(suspects, [i for i in enabled if i in trusted], command, failing=True)
+                else:
+                    # the verdicts were wrong
+                    errors = bisect(enabled, [], command, failing=True)
+
+            fixed = fix(errors) if fix else dict()
+            for i, block in fixed.items():
+                verdicts[keys[i]] = (False, errors.pop(i))
+                blocks[i] = block
+                keys[i] = block_key(block, flags)
+                trusted.discard(i)
+            if fixed:
+                print(f"{name}{len(fixed)} procs were fixed, compiling them again")
+
+            # TODO: offer possibility to edit it
+            for i, error in errors.items():
+                print(f"{name}ERROR on proc {i}: {blocks[i]}")
+                print(error)
+                failed[i] = error
+                verdicts[keys[i]] = (False, error)
+            enabled = [i for i in enabled if i not in failed]
+            print(f"{name}{len(errors)} procs were commented out and moved at the end of the code")
+            save_state()
+        done.append(command)
+        save_state()
+
+    if chunk_size:
+        write_module(code_path, module_header(enabled), enabled, with_failed=True)
+    return enabled, failed, compilations
+
+# check and compile (without linking) a shard of the blocks, as a separate
+# module with its own nimcache, so that shards can be repaired in parallel
+def repair_shard(shard, shard_blocks):
+    module = f"{path.splitext(path.basename(CODE_PATH))[0]}_shard{shard}"
+    with stage("repair", f"shard {shard}"):
+        return repair(header, blocks, enabled=shard_blocks, verdicts=verdicts,
+                      code_path=path.join(WORKSPACE, module + ".nim"),
+                      log_path=path.join(WORKSPACE, f"buffer_shard{shard}"),
+                      build_flags=("--noLinking", f"--nimcache:{path.join(WORKSPACE, 'nimcache_' + module)}"),
+                      name=f"[shard {shard}] ", fix=fix_mismatches, imports=block_imports)
+
+# build the repaired code with additional flags, in its own files
+# blocks failing with the default flags are not built again
+def build_variant(variant):
+    slug = re.sub(r"[^0-9A-Za-z]+", "_", variant).strip("_")
+    module = f"{path.splitext(path.basename(CODE_PATH))[0]}_{slug}"
+    with stage("repair", variant):
+        return repair(header, blocks, trailer, enabled, failed, verdicts,
+                      flags=NIM_FLAGS + variant.split(),
+                      code_path=path.join(WORKSPACE, module + ".nim"),
+                      log_path=path.join(WORKSPACE, f"buffer_{slug}"),
+                      commands=("c",),
+                      build_flags=(f"-o:{BINARY_PATH}_{slug}", f"--nimcache:{path.join(WORKSPACE, 'nimcache_' + slug)}"),
+                      name=f"[{variant}] ", imports=block_imports)
+
+# write the proc called by each block, and the digest of the code of each
+# lib, so that the next steps can be skipped for unchanged libs
+# NB: enabled is None when the code was not compiled
+def write_manifest(enabled):
+    compiled = set(enabled or ())
+    libs = collections.defaultdict(md5)
+    entries = list()
+    for i, (nimlib, _, proc_declaration_parsed, _, _) in enumerate(sources):
+        libs[nimlib].update(blocks[i].encode() + b"\0")
+        entries.append({
+            "lib": nimlib,
+            "proc": proc_declaration_parsed["name"],
+            "arguments": proc_declaration_parsed["arguments"],
+            "block": md5(blocks[i].encode()).hexdigest(),
+            "imports": block_imports[i],
+            "compiled": None if enabled is None else i in compiled,
+        })
+    content = {
+        "nimp_version": NIMP_VERSION,
+        "nim_version": nim_version,
+        "flags": NIM_FLAGS,
+        "header": md5(header.encode()).hexdigest(),
+        "libs": {k: v.hexdigest() for k, v in libs.items()},
+        "calls": entries,
+    }
+    tmp_path = f"{MANIFEST_PATH}.{getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(content, f, indent=2, sort_keys=True)
+    replace(tmp_path, MANIFEST_PATH)
+
+# report the metrics of the run, and clean its workspace up
+# NB: enabled is None when the code was not compiled
+def finish(enabled, compilations):
+    if sources:
+        write_manifest(enabled)
+    # time spent in each stage, the compilers excluded from the CPU time
+    for name, entry in stage_metrics.items():
+        print(f"# {name}: {entry['count']} times, {entry['wall']:.2f}s wall, {entry['cpu']:.2f}s cpu")
+    if args.metrics:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        report = {
+            "stages": stage_metrics,
+            "breakdown": breakdown_metrics,
+            "counters": {
+                "procs": number_total_procs,
+                "compiled": len(enabled or ()),
+                "skipped": number_skipped_procs,
+                "compilations": compilations,
+                "registry_lookups": registry_lookups,
+                "resolved_declarations": len(resolved_declarations),
+            },
+            "compilers_cpu": children.ru_utime + children.ru_stime,
+        }
+        with open(args.metrics, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
 
-while not compile() == 0:
-    print("An error occurred, backtracing the logs")
-    with open("/tmp/buffer", 'r') as f:
-        logs = f.read()
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
 
-    line_number, error_short = traceback(logs)
-    if not line_number:
-        print("Cannot backtrace, exiting")
-        exit(1)
+    if not args.workspace:
+        shutil.rmtree(WORKSPACE)
 
-    error_traceback = logs[logs.index(error_short):]
-
-    # TODO: offer possibility to edit it
-    all_code_lines = all_code.split("\n")
-    number_procs_compiled -= 1
-    line = all_code_lines.pop(line_number-1)
-    print(f"ERROR on line {line_number}: {line}")
-    print(error_traceback)
-    all_code_lines.append("# ERROR traceback\n #" + error_traceback.replace("\n", "\n# "))
-    all_code_lines.append("#" + line + "\n")
-    all_code = "\n".join(all_code_lines)
-    print("The line was commented out and moved at the end of the code")
-    #time.sleep(2)
+header, trailer = "\n".join(header_lines), ""
+if args.only_compile:
+    with open(CODE_PATH, "r") as f:
+        header, blocks, trailer = split_blocks(f.read())
+    # the imports are part of the header read
+    block_imports = None
+if checkpoint is not None:
+    header, trailer = checkpoint["header"], checkpoint["trailer"]
+    blocks, block_imports, sources = checkpoint["blocks"], checkpoint["block_imports"], checkpoint["sources"]
+    repair_states = checkpoint["repairs"]
+
+number_total_procs = len(blocks)
+compilations = collections.Counter()
+commands = ("check", "c")
+enabled, failed = None, dict()
+
+if args.no_compile:
+    with open(CODE_PATH, "w") as f:
+        code_header = "\n".join(import_lines(itertools.chain.from_iterable(block_imports)) + [header])
+        f.write("\n" + code_header + "\n\n" + "".join(block + "\n\n" for block in blocks))
+    print(f"Generated {number_total_procs} procs")
+    finish(None, compilations)
+    exit(0)
+
+verdicts = load_cache(VERDICTS_CACHE_PATH) or dict()
+if checkpoint is not None:
+    verdicts.update(checkpoint["verdicts"])
+save_checkpoint()
+
+if args.jobs > 1 and blocks:
+    # compiler processes are the heavy part, threads are enough to drive them
+    shard_size = -(-len(blocks) // args.jobs)
+    shards = [list(range(len(blocks)))[k:k+shard_size] for k in range(0, len(blocks), shard_size)]
+    print(f"# Repairing {len(shards)} shards with {args.jobs} jobs")
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        results = executor.map(repair_shard, range(len(shards)), shards)
+        enabled = list()
+        for shard_enabled, shard_failed, shard_compilations in results:
+            enabled += shard_enabled
+            failed.update(shard_failed)
+            compilations += shard_compilations
+    # every shard is known to compile, the code is only built, without
+    # checking it again
+    # NB: the shards are modules of their own, compiled without linking in
+    # their own nimcache, so that the final build compiles the whole code
+    # again in a new nimcache: their objects are not reused
+    commands = ("c",)
+
+with stage("repair", "main"):
+    enabled, failed, final_compilations = repair(header, blocks, trailer, enabled, failed, verdicts, commands=commands,
+                                                 fix=fix_mismatches, imports=block_imports)
+compilations += final_compilations
+print(f"Successfully compiled {len(enabled)}/{number_total_procs} procs")
+
+if args.matrix or args.variants:
+    variants = args.variants or MATRIX
+    print(f"# Building {len(variants)} variants with {args.jobs} jobs")
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        results = executor.map(build_variant, variants)
+        for variant, (variant_enabled, _, variant_compilations) in zip(variants, results):
+            compilations += variant_compilations
+            print(f"[{variant}] Successfully compiled {len(variant_enabled)}/{number_total_procs} procs")
+
+# verdicts found by concurrent runs meanwhile are kept, ours prevail
+with locked(VERDICTS_CACHE_PATH):
+    dump_cache({**(load_cache(VERDICTS_CACHE_PATH) or dict()), **verdicts}, VERDICTS_CACHE_PATH)
+# the repair is over, and can't be resumed anymore
+remove(CHECKPOINT_PATH)
+print(f"# {sum(compilations.values())} compilations ({compilations['check']} check, {compilations['c']} c)")
+# the first compilation of each repair starts from an empty nimcache, the
+# next ones are incremental
+for command in ("check", "c"):
+    first, incremental, seen = list(), list(), set()
+    for repair_name, repair_command, seconds in compile_times:
+        if repair_command == command:
+            (incremental if repair_name in seen else first).append(seconds)
+            seen.add(repair_name)
+    if first:
+        print(f"# {command}: {len(first)} first builds in {sum(first) / len(first):.2f}s on average", end="")
+        print(f", {len(incremental)} incremental builds in {sum(incremental) / len(incremental):.2f}s on average" if incremental else "")
+
+finish(enabled, compilations)